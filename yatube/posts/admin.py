@@ -1,8 +1,55 @@
+import hashlib
+
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+
 from .models import Post, Group
+from .search import fts_supported, match_query, matching_ids
+from .ulits import CachedCountPaginator
+
+
+class CachedCountAdmin(admin.ModelAdmin):
+    """Список без полного COUNT: число записей берется из кеша.
+
+    Для неотфильтрованного списка - счетчик ленты count_feed, который
+    сбрасывают сигналы. Для фильтров и поиска число кешируется по тексту
+    запроса и может отставать на COUNT_CACHE_TIMEOUT.
+    """
+    show_full_result_count = False
+    count_feed = None
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        feed = self.count_feed
+        if queryset.query.where or feed is None:
+            digest = hashlib.md5(str(queryset.query).encode()).hexdigest()
+            feed = f'admin:{self.model._meta.label_lower}:{digest}'
+        return CachedCountPaginator(
+            queryset, per_page, feed=feed, orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+        )
+
 
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    """Автодополнение, которое показывает уже загруженные объекты loaded
+    вместо запроса выбранного значения на каждую строку списка."""
+    loaded = None
 
-class PostAdmin(admin.ModelAdmin):
+    def optgroups(self, name, value, attr=None):
+        if self.loaded is None:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        for obj in self.loaded:
+            options.append(self.create_option(
+                name, obj.pk, self.choices.field.label_from_instance(obj),
+                str(obj.pk) in value, len(options),
+            ))
+        return [(None, options, 0)]
+
+
+class PostAdmin(CachedCountAdmin):
     list_display = (
         'pk',
         'text',
@@ -11,12 +58,46 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    raw_id_fields = ('author',)
+    autocomplete_fields = ('group',)
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    # Неотфильтрованный список совпадает с главной лентой.
+    count_feed = 'index'
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group':
+            kwargs['widget'] = LoadedAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'),
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        form = super().get_changelist_form(request, **kwargs)
+
+        class ChangeListForm(form):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                # Группа строки уже загружена через list_select_related.
+                widget = self.fields['group'].widget
+                widget = getattr(widget, 'widget', widget)
+                group = self.instance.group
+                widget.loaded = [] if group is None else [group]
+
+        return ChangeListForm
+
+    def get_search_results(self, request, queryset, search_term):
+        if not fts_supported():
+            return super().get_search_results(request, queryset, search_term)
+        if match_query(search_term) is None:
+            return queryset, False
+        return queryset.filter(pk__in=matching_ids(search_term)), False
 
 
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(CachedCountAdmin):
     list_display = (
         'pk',
         'title',
@@ -0,0 +1,333 @@
+"""JSON API только для чтения: те же ленты, что и HTML-страницы.
+
+Страницы листаются курсором, ?fields= оставляет в записях только
+нужные поля. Ответы кешируются по версии ленты, как и HTML.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition, require_GET
+
+from .images import CARD_VARIANTS, THUMBNAIL_SIZES, lookup_thumbnails
+from .models import Group, Post, User
+from .timeline import get_timeline_posts
+from .ulits import (
+    CURSOR_PARAM, FEED_CACHE_TIMEOUT, NEWER, decode_cursor, encode_cursor,
+    feed_latest, feed_version, feed_versions, get_cursor_page,
+)
+
+FIELDS_PARAM: str = 'fields'
+CONTENT_TYPE: str = 'application/json'
+# Сколько id новых постов отдает опрос, число считается полностью.
+NEW_POSTS_LIMIT: int = 100
+# Без пробелов и \u-экранирования кириллицы.
+JSON_PARAMS = {'separators': (',', ':'), 'ensure_ascii': False}
+
+
+POST_FIELDS = {
+    'id': lambda post: post.pk,
+    'text': lambda post: post.text,
+    'pub_date': lambda post: post.pub_date,
+    'updated': lambda post: post.updated,
+    'author': lambda post: post.author.username,
+    'group': lambda post: post.group.slug if post.group else None,
+    'comments_count': lambda post: post.comments_count,
+    'image': lambda post: post.image.url if post.image else None,
+    'thumbnails': lambda post: post.thumbnail_urls,
+}
+COMMENT_FIELDS = {
+    'id': lambda comment: comment.pk,
+    'text': lambda comment: comment.text,
+    'created': lambda comment: comment.created,
+    'author': lambda comment: comment.author.username,
+}
+
+
+class FieldsError(ValueError):
+    """В ?fields= есть поля, которых нет в записи."""
+
+
+def requested_fields(request, available):
+    """Поля из ?fields= в порядке available, по умолчанию - все."""
+    value = request.GET.get(FIELDS_PARAM)
+    if not value:
+        return list(available)
+    names = {name.strip() for name in value.split(',')} - {''}
+    unknown = names - set(available)
+    if unknown:
+        raise FieldsError(
+            'Неизвестные поля: ' + ', '.join(sorted(unknown))
+        )
+    return [name for name in available if name in names]
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params=JSON_PARAMS)
+
+
+def json_errors(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except FieldsError as error:
+            return json_response({'error': str(error)}, status=400)
+    return wrapper
+
+
+def api_cache_key(name, request):
+    # Путь с запросом приходит от клиента: в ключ идет только его хеш.
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'api:{name}:{feed_version(name)}:{path}'
+
+
+def depend_on(request, *feeds):
+    """Отмечает ленты, данные которых попали в кешируемый ответ."""
+    if hasattr(request, 'api_depends'):
+        request.api_depends.update(feeds)
+
+
+def depend_on_posts(request, posts):
+    """Счетчик комментариев, логин автора и слаг группы в записях."""
+    depend_on(request, *(f'post:{post.pk}' for post in posts))
+    depend_on(request, *(f'card-author:{post.author_id}' for post in posts))
+    depend_on(request, *(
+        f'card-group:{post.group_id}' for post in posts if post.group_id
+    ))
+
+
+def entry_etag(key, versions):
+    raw = repr((key, sorted(versions.items())))
+    return 'api-' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_entry(key):
+    """(ETag, содержимое) ответа из кеша, если его данные не менялись."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    versions, content = entry
+    if versions and feed_versions(*versions) != versions:
+        return None
+    return entry_etag(key, versions), content
+
+
+def cache_json(feed):
+    """Кеширует ответ, пока не изменится версия ленты feed.
+
+    feed - шаблон имени ленты из аргументов URL, как в cache_feed.
+    Ответ не зависит от пользователя и общий для всех. Вместе с ним
+    хранятся версии лент, отмеченных через depend_on: комментарий или
+    переименование автора не меняют версию ленты, но делают ответ
+    устаревшим. ETag считается из тех же версий.
+    """
+    def etag(request, **kwargs):
+        entry = cached_entry(api_cache_key(feed.format(**kwargs), request))
+        return entry[0] if entry is not None else None
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = api_cache_key(feed.format(**kwargs), request)
+            entry = cached_entry(key)
+            if entry is not None:
+                tag, content = entry
+                response = HttpResponse(content, content_type=CONTENT_TYPE)
+            else:
+                request.api_depends = set()
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                versions = feed_versions(*request.api_depends)
+                cache.set(
+                    key, (versions, response.content), FEED_CACHE_TIMEOUT
+                )
+                tag = entry_etag(key, versions)
+            response['ETag'] = quote_etag(tag)
+            return response
+        return condition(etag_func=etag)(wrapper)
+    return decorator
+
+
+def api_view(feed=None):
+    """GET-вьюха API; с feed ответ кешируется по версии ленты."""
+    def decorator(view):
+        view = json_errors(view)
+        if feed is not None:
+            view = cache_json(feed)(view)
+        return require_GET(view)
+    return decorator
+
+
+def set_thumbnail_urls(posts):
+    """Ставит постам готовые миниатюры одним чтением KVStore."""
+    found = lookup_thumbnails(posts)
+    for post in posts:
+        post.thumbnail_urls = []
+        for mime, variants in CARD_VARIANTS.items():
+            for width, size in variants:
+                thumbnail = found.get((post.pk, THUMBNAIL_SIZES.index(size)))
+                if thumbnail is not None:
+                    post.thumbnail_urls.append(
+                        {'type': mime, 'width': width, 'url': thumbnail.url}
+                    )
+
+
+def serialize(records, fields, serializers):
+    return [
+        {name: serializers[name](record) for name in fields}
+        for record in records
+    ]
+
+
+def serialize_posts(posts, fields):
+    if 'thumbnails' in fields:
+        set_thumbnail_urls(posts)
+    return serialize(posts, fields, POST_FIELDS)
+
+
+def serialize_comments(comments, fields):
+    return serialize(comments, fields, COMMENT_FIELDS)
+
+
+def page_data(request, records, serialize, available, **kwargs):
+    """Страница записей по курсору и ссылки-курсоры на соседние."""
+    fields = requested_fields(request, available)
+    page = get_cursor_page(records, request.GET.get(CURSOR_PARAM), **kwargs)
+    return page, {
+        'results': serialize(page.object_list, fields),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def post_page(request, posts):
+    page, data = page_data(request, posts, serialize_posts, POST_FIELDS)
+    depend_on_posts(request, page.object_list)
+    if page.object_list and not page.has_previous():
+        # Начало ленты: с этим курсором клиент опрашивает .../new/.
+        data['poll'] = encode_cursor(page.object_list[0], NEWER)
+    return data
+
+
+@api_view('index')
+def index(request):
+    posts = Post.objects.select_related('author', 'group')
+    return json_response(post_page(request, posts))
+
+
+@api_view('group:{slug}')
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    data = post_page(request, group.posts.select_related('author', 'group'))
+    data['group'] = {
+        'slug': group.slug,
+        'title': group.title,
+        'description': group.description,
+    }
+    return json_response(data)
+
+
+@api_view('profile:{username}')
+def profile(request, username):
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    data = post_page(request, author.posts.select_related('author', 'group'))
+    data['author'] = {
+        'username': author.username,
+        'full_name': author.get_full_name(),
+        'posts_count': author.stats.posts_count,
+        'followers_count': author.stats.followers_count,
+        'following_count': author.stats.following_count,
+    }
+    return json_response(data)
+
+
+@api_view()
+def follow_index(request):
+    # Лента подписок у каждого своя и в общий кеш не попадает.
+    if not request.user.is_authenticated:
+        return json_response({'error': 'Нужно войти'}, status=401)
+    return json_response(post_page(request, get_timeline_posts(request.user)))
+
+
+@api_view('post:{post_id}')
+def post_detail(request, post_id):
+    fields = requested_fields(request, POST_FIELDS)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
+    depend_on_posts(request, [post])
+    return json_response(serialize_posts([post], fields)[0])
+
+
+@api_view('post:{post_id}')
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = post.comments.select_related('author')
+    page, data = page_data(
+        request, comments, serialize_comments, COMMENT_FIELDS,
+        field='created', descending=False,
+    )
+    depend_on(request, *(
+        f'card-author:{comment.author_id}' for comment in page.object_list
+    ))
+    return json_response(data)
+
+
+def new_posts(request, feed, get_posts):
+    """Число и id постов ленты новее курсора.
+
+    Пока новейший пост ленты в кеше не новее курсора, база не читается:
+    get_posts строит выборку только когда она нужна.
+    """
+    position = decode_cursor(request.GET.get(CURSOR_PARAM, ''))
+    if position is None:
+        return json_response({'error': 'Нужен курсор'}, status=400)
+    _, pub_date, pk = position
+    latest = feed_latest(feed, get_posts)
+    if latest is None or latest <= (pub_date, pk):
+        return json_response({'count': 0, 'ids': []})
+    newer = get_posts().filter(
+        Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+    ).order_by('-pub_date', '-pk')
+    ids = list(newer.values_list('pk', flat=True)[:NEW_POSTS_LIMIT + 1])
+    count = len(ids) if len(ids) <= NEW_POSTS_LIMIT else newer.count()
+    return json_response({'count': count, 'ids': ids[:NEW_POSTS_LIMIT]})
+
+
+@api_view()
+def index_new(request):
+    return new_posts(request, 'index', Post.objects.all)
+
+
+@api_view()
+def group_new(request, slug):
+    return new_posts(
+        request, f'group:{slug}',
+        lambda: Post.objects.filter(group__slug=slug),
+    )
+
+
+@api_view()
+def profile_new(request, username):
+    return new_posts(
+        request, f'profile:{username}',
+        lambda: Post.objects.filter(author__username=username),
+    )
+
+
+@api_view()
+def follow_new(request):
+    if not request.user.is_authenticated:
+        return json_response({'error': 'Нужно войти'}, status=401)
+    return new_posts(
+        request, f'follow:{request.user.pk}',
+        lambda: get_timeline_posts(request.user),
+    )
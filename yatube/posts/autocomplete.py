@@ -0,0 +1,169 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Group, User
+
+AUTOCOMPLETE_LIMIT: int = 10
+# Как часто процесс сверяет свой индекс с изменениями в других процессах.
+REFRESH_INTERVAL: int = 5
+# Номер последнего изменения и сами изменения: (вид, id, запись или None).
+VERSION_KEY: str = 'autocomplete_version'
+CHANGE_KEY: str = 'autocomplete_change:{}'
+CHANGE_TIMEOUT: int = 60 * 60
+# Если отстали сильнее, проще перечитать базу.
+MAX_CHANGES: int = 1000
+# Без общего кеша изменения других процессов сюда не доходят,
+# и индекс просто перечитывается с таким интервалом.
+LOCAL_RELOAD_INTERVAL: int = 60
+USER, GROUP = 'user', 'group'
+
+
+def _normalize(value):
+    return ' '.join(value.lower().split())
+
+
+def user_entry(user):
+    full_name = f'{user.first_name} {user.last_name}'.strip()
+    label = f'{full_name} (@{user.username})' if full_name else user.username
+    keys = {user.username, full_name, user.last_name}
+    return label, user.username, keys
+
+
+def group_entry(group):
+    return group.title, group.slug, {group.title, group.slug}
+
+
+def _entry(kind, obj):
+    label, arg, names = (user_entry if kind == USER else group_entry)(obj)
+    return label, arg, {_normalize(name) for name in names} - {''}
+
+
+def _version():
+    cache.add(VERSION_KEY, 0, None)
+    return cache.get(VERSION_KEY, 0)
+
+
+class PrefixIndex:
+    """Отсортированный список ключей, поиск префикса через bisect.
+
+    Индекс живет в памяти процесса. Каждая правка пишет в кеш изменение
+    под очередным номером, остальные процессы раз в REFRESH_INTERVAL
+    применяют новые изменения у себя. База перечитывается целиком
+    только при старте и если изменения пропали из кеша.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._entries = {}
+        self._version = None
+        self._checked = 0
+        self._loaded = 0
+
+    def _load(self):
+        # Номер до чтения: изменения во время чтения применятся повторно,
+        # это безопасно.
+        self._version = _version()
+        self._loaded = time.monotonic()
+        self._keys, self._entries = [], {}
+        users = User.objects.only(
+            'pk', 'username', 'first_name', 'last_name'
+        ).iterator()
+        groups = Group.objects.only('pk', 'title', 'slug').iterator()
+        for kind, objects in ((USER, users), (GROUP, groups)):
+            for obj in objects:
+                entry = _entry(kind, obj)
+                self._entries[kind, obj.pk] = entry
+                self._keys.extend((key, kind, obj.pk) for key in entry[2])
+        self._keys.sort()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._keys is not None and now - self._checked < REFRESH_INTERVAL:
+            return
+        self._checked = now
+        stale = (not settings.SHARED_CACHE
+                 and now - self._loaded >= LOCAL_RELOAD_INTERVAL)
+        if self._keys is None or stale:
+            self._load()
+            return
+        version = _version()
+        if version == self._version:
+            return
+        numbers = range(self._version + 1, version + 1)
+        keys = [CHANGE_KEY.format(number) for number in numbers]
+        changes = cache.get_many(keys) if 0 < len(keys) <= MAX_CHANGES else {}
+        # Счетчик сбросился, изменения вытеснены или их слишком много.
+        if len(changes) != len(keys) or not keys:
+            self._load()
+            return
+        for key in keys:
+            self._apply(*changes[key])
+        self._version = version
+
+    def _apply(self, kind, pk, entry):
+        self._remove(kind, pk)
+        if entry is not None:
+            self._entries[kind, pk] = entry
+            for key in entry[2]:
+                insort(self._keys, (key, kind, pk))
+
+    def _remove(self, kind, pk):
+        entry = self._entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            position = bisect_left(self._keys, (key, kind, pk))
+            if self._keys[position:position + 1] == [(key, kind, pk)]:
+                del self._keys[position]
+
+    def _publish(self, kind, pk, entry):
+        """Записывает изменение для всех процессов и применяет у себя.
+
+        Свое изменение другие применят по номеру, а этот процесс
+        повторит его при следующей сверке - повтор ничего не меняет.
+        """
+        try:
+            number = cache.incr(VERSION_KEY)
+        except ValueError:
+            _version()
+            number = cache.incr(VERSION_KEY)
+        cache.set(CHANGE_KEY.format(number), (kind, pk, entry), CHANGE_TIMEOUT)
+        with self._lock:
+            if self._keys is not None:
+                self._apply(kind, pk, entry)
+
+    def update(self, kind, obj):
+        entry = _entry(kind, obj)
+        if self._entries.get((kind, obj.pk)) == entry:
+            return
+        self._publish(kind, obj.pk, entry)
+
+    def remove(self, kind, pk):
+        self._publish(kind, pk, None)
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Записи, у которых один из ключей начинается с prefix."""
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            self._refresh()
+            position = bisect_left(self._keys, (prefix,))
+            found = []
+            while position < len(self._keys) and len(found) < limit:
+                key, kind, pk = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if (kind, pk) not in found:
+                    found.append((kind, pk))
+                position += 1
+            return [(kind,) + self._entries[kind, pk][:2]
+                    for kind, pk in found]
+
+
+index = PrefixIndex()
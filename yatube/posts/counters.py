@@ -0,0 +1,64 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, User, UserStats
+
+# Счетчик пользователя -> (модель, поле со ссылкой на пользователя).
+USER_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def _increment(field, delta):
+    return Greatest(F(field) + delta, 0)
+
+
+def bump_user(user_id, **deltas):
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: _increment(field, delta) for field, delta in deltas.items()}
+    )
+
+
+def bump_post(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=_increment('comments_count', delta)
+    )
+
+
+def real_count(model, field):
+    """Подзапрос с настоящим числом строк model, ссылающихся на OuterRef."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def _repair(queryset, field, real):
+    drifted = queryset.annotate(real=real).exclude(**{field: F('real')})
+    return queryset.filter(pk__in=drifted.values('pk')).update(**{field: real})
+
+
+def repair_counters():
+    """Пересчитывает разошедшиеся счетчики, возвращает число исправлений."""
+    missing = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True
+    )
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing], ignore_conflicts=True
+    )
+    fixed = {
+        field: _repair(UserStats.objects.all(), field, real_count(*source))
+        for field, source in USER_COUNTERS.items()
+    }
+    fixed['comments_count'] = _repair(
+        Post.objects.all(), 'comments_count', real_count(Comment, 'post')
+    )
+    return fixed
@@ -0,0 +1,43 @@
+"""Потоковая выгрузка постов в форматах, которые читает import_posts."""
+import csv
+import json
+
+EXPORT_CHUNK_SIZE: int = 2000
+EXPORT_FIELDS = ('id', 'text', 'pub_date', 'author', 'group')
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class Echo:
+    """Файл для csv.writer, который возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(posts):
+    """Кортежи полей EXPORT_FIELDS, читаются с сервера частями."""
+    rows = posts.order_by('-pub_date', '-pk').values_list(
+        'pk', 'text', 'pub_date', 'author__username', 'group__slug'
+    )
+    for pk, text, pub_date, author, group in rows.iterator(
+            chunk_size=EXPORT_CHUNK_SIZE):
+        yield pk, text, pub_date.isoformat(), author, group or ''
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)),
+                         ensure_ascii=False) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+LINES = {'jsonl': jsonl_lines, 'csv': csv_lines}
@@ -1,4 +1,7 @@
 from django import forms
+from PIL import Image
+
+from .images import ImageRejected, normalize_image
 from . models import Post, Comment
 
 
@@ -15,6 +18,21 @@ class PostForm(forms.ModelForm):
             'group': 'Группа, к которой будет относиться пост',
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Новая загрузка, а не уже сохраненный файл поста.
+        if not image or not hasattr(image, 'content_type'):
+            return image
+        try:
+            return normalize_image(image)
+        except (ImageRejected, Image.DecompressionBombError) as error:
+            raise forms.ValidationError(str(error))
+        except (OSError, ValueError):
+            # verify() не декодирует пиксели: битый файл всплывает здесь.
+            raise forms.ValidationError(
+                'Картинка повреждена или не поддерживается'
+            )
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
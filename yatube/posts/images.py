@@ -0,0 +1,268 @@
+import logging
+import os
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore
+)
+from sorl.thumbnail.models import KVStore
+
+from .models import Post, ThumbnailJob
+from .ulits import bump_feed_versions
+
+logger = logging.getLogger(__name__)
+
+CARD_WIDTHS = (480, 960)
+CARD_RATIO = 339 / 960
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+# Ширина картинки в колонке ленты для атрибута sizes.
+CARD_SIZES = '(max-width: 960px) 100vw, 960px'
+WEBP_SUPPORTED = features.check('webp')
+MAX_ATTEMPTS: int = 3
+# Сколько секунд после загрузки или дедупликации файл не освобождается.
+RELEASE_GRACE: int = 60 * 10
+# Ограничения на загружаемые картинки.
+MAX_IMAGE_SIDE: int = 1920
+MAX_IMAGE_PIXELS: int = 40 * 1000 * 1000
+MAX_ANIMATION_PIXELS: int = 100 * 1000 * 1000
+JPEG_QUALITY: int = 85
+# Форматы, которые сохраняются как есть, остальные переводятся в PNG.
+KEPT_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def card_size(width, **options):
+    return f'{width}x{round(width * CARD_RATIO)}', {**CARD_OPTIONS, **options}
+
+
+# Картинка в <img>: самая широкая в формате по умолчанию.
+CARD_THUMBNAIL = card_size(CARD_WIDTHS[-1])
+# Варианты для srcset: тип -> [(ширина, размер миниатюры)].
+CARD_VARIANTS = {
+    'image/jpeg': [(width, card_size(width)) for width in CARD_WIDTHS],
+}
+if WEBP_SUPPORTED:
+    CARD_VARIANTS = {
+        'image/webp': [
+            (width, card_size(width, format='WEBP')) for width in CARD_WIDTHS
+        ],
+        **CARD_VARIANTS,
+    }
+# Размеры миниатюр, которые выводят шаблоны.
+THUMBNAIL_SIZES = tuple(
+    size for variants in CARD_VARIANTS.values() for _, size in variants
+)
+
+
+class ImageRejected(ValueError):
+    """Картинку нельзя принять: она слишком большая для разбора."""
+
+
+def normalize_image(upload):
+    """Приводит загрузку к разумному виду до сохранения в media/posts/.
+
+    Размер проверяется по заголовку, до декодирования пикселей. Картинка
+    поворачивается по EXIF, уменьшается до MAX_IMAGE_SIDE и
+    пересохраняется без метаданных. Анимации в пределах ограничений
+    сохраняются как есть: перекодирование кадров дороже, чем их хранение.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    frames = getattr(image, 'n_frames', 1)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(
+            f'Картинка {width}x{height} больше {MAX_IMAGE_PIXELS} пикселей'
+        )
+    if frames > 1:
+        if (width * height * frames > MAX_ANIMATION_PIXELS
+                or max(width, height) > MAX_IMAGE_SIDE):
+            raise ImageRejected('Слишком большая анимация')
+        upload.seek(0)
+        return upload
+    image_format = image.format if image.format in KEPT_FORMATS else 'PNG'
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    options = {}
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+        options = {'quality': JPEG_QUALITY, 'optimize': True}
+    elif image_format == 'PNG':
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        options = {'optimize': True}
+    elif image_format == 'WEBP':
+        options = {'quality': JPEG_QUALITY}
+    content = BytesIO()
+    # Без exif=... Pillow не переносит метаданные в новый файл.
+    image.save(content, image_format, **options)
+    name = f'{os.path.splitext(upload.name)[0]}.{KEPT_FORMATS[image_format]}'
+    return SimpleUploadedFile(
+        name, content.getvalue(),
+        content_type=Image.MIME[image_format],
+    )
+
+
+def release_image(name):
+    """Удаляет картинку и ее миниатюры, если на нее не ссылается ни один
+    пост. Файлы общие у постов с одинаковым содержимым."""
+    upload_to = Post._meta.get_field('image').upload_to
+    # Чужие пути (не из загрузок) не трогаем.
+    if not name or not name.startswith(upload_to):
+        return
+    if Post.objects.filter(image=name).exists():
+        return
+    image = Post(image=name).image
+    try:
+        modified = os.path.getmtime(image.path)
+    except FileNotFoundError:
+        modified = 0
+    # Свежую дату ставит и повторная загрузка того же содержимого: пост
+    # с ней мог еще не закоммититься. Такой файл, если он и правда
+    # никому не нужен, потом уберет collect_media.
+    if time.time() - modified < RELEASE_GRACE:
+        return
+    delete(image)
+
+
+def enqueue_thumbnails(post):
+    """Ставит картинку поста в очередь на построение миниатюр."""
+    if post.image:
+        ThumbnailJob.objects.get_or_create(post=post, image=post.image.name)
+
+
+def build_thumbnails(image, sizes=THUMBNAIL_SIZES):
+    for geometry, options in sizes:
+        thumbnail = get_thumbnail(image, geometry, **options)
+        # sorl не падает на битом исходнике, а отдает пустую миниатюру.
+        if not thumbnail.exists():
+            raise FileNotFoundError(f'Не удалось построить {thumbnail.name}')
+
+
+def thumbnail_file(image, geometry, options):
+    """Миниатюра, которую построит get_thumbnail, без обращения к хранилищу.
+
+    Повторяет расчет опций и имени файла из ThumbnailBackend.get_thumbnail.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def _read_kvstore(keys):
+    """Записи KVStore sorl по ключам: одно чтение кеша и один запрос
+    к базе за промахами, как в cached_db KVStore, но пачкой."""
+    if not isinstance(default.kvstore, CachedDBKVStore):
+        values = {key: default.kvstore._get_raw(key) for key in keys}
+        return {key: value for key, value in values.items() if value}
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        # Как и cached_db KVStore, запоминаем отсутствие записи.
+        fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+        kv_cache.set_many(fetched, settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {key: value for key, value in values.items()
+            if value != EMPTY_VALUE}
+
+
+def lookup_thumbnails(posts, sizes=THUMBNAIL_SIZES):
+    """Построенные миниатюры постов: {(post.pk, номер размера): файл}."""
+    keys = {}
+    for post in posts:
+        if not post.image:
+            continue
+        for index, (geometry, options) in enumerate(sizes):
+            thumbnail = thumbnail_file(post.image, geometry, options)
+            keys[add_prefix(thumbnail.key)] = (post.pk, index)
+    if not keys:
+        return {}
+    return {
+        keys[key]: deserialize_image_file(value)
+        for key, value in _read_kvstore(list(keys)).items()
+    }
+
+
+def prefetch_thumbnails(posts):
+    """Проставляет постам миниатюры из KVStore одним чтением.
+
+    post.thumbnail - картинка для src, post.thumbnail_sources - srcset
+    по типам. Пока миниатюры не построены, post.thumbnail равен None,
+    и шаблон построит ее сам.
+    """
+    found = lookup_thumbnails(posts)
+    fallback = THUMBNAIL_SIZES.index(CARD_THUMBNAIL)
+    for post in posts:
+        post.thumbnail = found.get((post.pk, fallback))
+        post.thumbnail_sources = []
+        for mime, variants in CARD_VARIANTS.items():
+            srcset = []
+            for width, size in variants:
+                thumbnail = found.get((post.pk, THUMBNAIL_SIZES.index(size)))
+                if thumbnail is not None:
+                    srcset.append(f'{thumbnail.url} {width}w')
+            if srcset:
+                post.thumbnail_sources.append({
+                    'type': mime,
+                    'srcset': ', '.join(srcset),
+                    'sizes': CARD_SIZES,
+                })
+
+
+def post_pages(post):
+    pages = ['index', f'profile:{post.author.username}', f'post:{post.pk}']
+    if post.group_id is not None:
+        pages.append(f'group:{post.group.slug}')
+    return pages
+
+
+def process_jobs(limit):
+    """Обрабатывает до limit задач, возвращает (готово, с ошибкой)."""
+    done = failed = 0
+    jobs = ThumbnailJob.objects.select_related(
+        'post__author', 'post__group'
+    )[:limit]
+    for job in jobs:
+        # Картинку успели заменить: для новой есть своя задача.
+        if job.post.image.name != job.image:
+            job.delete()
+            done += 1
+            continue
+        try:
+            build_thumbnails(job.post.image)
+        except Exception as error:
+            logger.exception('Миниатюры для %s не построены', job.image)
+            failed += 1
+            job.attempts += 1
+            if job.attempts >= MAX_ATTEMPTS:
+                job.delete()
+            else:
+                job.error = str(error)
+                job.save(update_fields=['attempts', 'error'])
+            continue
+        done += 1
+        job.delete()
+        # В закешированных страницах и ответах API еще нет миниатюр.
+        bump_feed_versions(*post_pages(job.post))
+    return done, failed
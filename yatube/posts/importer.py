@@ -0,0 +1,181 @@
+"""Потоковый импорт постов: чтение -> разбор -> пачки -> bulk_create.
+
+Строки читаются генераторами и не копятся в памяти: в каждый момент
+в памяти одна пачка и ограниченные кеши авторов и групп.
+"""
+import csv
+import json
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import counters, search, timeline
+from .models import Group, Post, User
+from .ulits import bump_feed_versions, invalidate_feed_counts
+
+IMPORT_BATCH_SIZE: int = 1000
+LOOKUP_CACHE_SIZE: int = 10000
+FORMATS = ('jsonl', 'csv')
+# Маршрут <slug:slug> принимает только латиницу, цифры, _ и -.
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+})
+
+
+class ImportRowError(ValueError):
+    """Строку нельзя превратить в пост."""
+
+
+class ImportNotSupported(RuntimeError):
+    """База не дает узнать id вставленных постов."""
+
+
+def read_rows(stream, data_format):
+    """Словари строк из JSONL или CSV по одной."""
+    if data_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Битая строка не останавливает импорт, build_post ее отбросит.
+            yield None
+
+
+@lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def author_id(username):
+    user, _ = User.objects.get_or_create(username=username)
+    return user.pk
+
+
+def group_slug(name):
+    return slugify(name.lower().translate(TRANSLIT))[:50]
+
+
+@lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def group_id(name):
+    """Группа по slug или названию, новая получает slug транслитом."""
+    slug = group_slug(name)
+    if not slug:
+        raise ImportRowError(f'из группы «{name}» не получается slug')
+    group = Group.objects.filter(Q(slug=slug) | Q(title=name)).first()
+    if group is None:
+        group = Group.objects.create(slug=slug, title=name)
+    return group.pk
+
+
+def build_post(row):
+    if not isinstance(row, dict):
+        raise ImportRowError('строка не разобрана')
+    text = (row.get('text') or '').strip()
+    username = (row.get('author') or '').strip()
+    if not text or not username:
+        raise ImportRowError('нужны text и author')
+    pub_date = row.get('pub_date')
+    if pub_date:
+        pub_date = parse_datetime(pub_date)
+        if pub_date is None:
+            raise ImportRowError('pub_date не в формате ISO 8601')
+        if timezone.is_naive(pub_date):
+            pub_date = timezone.make_aware(pub_date)
+    group = (row.get('group') or '').strip()
+    return Post(
+        text=text,
+        author_id=author_id(username),
+        group_id=group_id(group) if group else None,
+        pub_date=pub_date or timezone.now(),
+    )
+
+
+def build_posts(rows, on_error):
+    for number, row in enumerate(rows, 1):
+        try:
+            yield build_post(row)
+        except ImportRowError as error:
+            on_error(number, error)
+
+
+def inserted_ids(batch):
+    """id постов пачки сразу после bulk_create в той же транзакции."""
+    if all(post.pk is not None for post in batch):
+        return [post.pk for post in batch]
+    # SQLite не возвращает id, но с первого INSERT транзакция держит
+    # блокировку записи: других вставок нет, id пачки идут подряд.
+    last = Post.objects.aggregate(last=Max('pk'))['last']
+    return list(range(last - len(batch) + 1, last + 1))
+
+
+def insert_batch(batch):
+    """Вставляет пачку с датами из файла, возвращает id постов."""
+    # bulk_create ставит pub_date через auto_now_add, даты из файла
+    # возвращаются отдельным bulk_update.
+    dates = [post.pub_date for post in batch]
+    Post.objects.bulk_create(batch)
+    ids = inserted_ids(batch)
+    for post, pk, pub_date in zip(batch, ids, dates):
+        post.pk, post.pub_date = pk, pub_date
+    Post.objects.bulk_update(batch, ['pub_date'])
+    return ids
+
+
+def _after_insert(ids):
+    """То, что для одиночного поста делают сигналы, но для всей пачки."""
+    posts = Post.objects.filter(pk__in=ids).order_by()
+    created = list(posts.values_list('pk', 'author_id', 'pub_date'))
+    for author, count in Counter(row[1] for row in created).items():
+        counters.bump_user(author, posts_count=count)
+    timeline.fan_out_posts(created)
+    if search.fts_supported():
+        # Полнотекстовый индекс есть только в SQLite, где id идут подряд.
+        search.index_post_range(ids[0], ids[-1])
+    feeds = {'index'}
+    feeds.update(
+        f'profile:{username}' for username in posts.values_list(
+            'author__username', flat=True
+        ).distinct()
+    )
+    feeds.update(
+        f'group:{slug}' for slug in posts.filter(
+            group__isnull=False
+        ).values_list('group__slug', flat=True).distinct()
+    )
+    invalidate_feed_counts(*feeds)
+    bump_feed_versions(*feeds)
+
+
+def import_posts(rows, on_error, batch_size=IMPORT_BATCH_SIZE):
+    """Импортирует посты пачками, после каждой отдает число готовых.
+
+    on_error(номер строки, ошибка) вызывается для пропущенных строк.
+    """
+    if (connection.vendor != 'sqlite'
+            and not connection.features.can_return_ids_from_bulk_insert):
+        raise ImportNotSupported(
+            f'Импорт не поддерживает базу {connection.vendor}'
+        )
+    # Кеши живут один импорт: между запусками записи могли удалить.
+    author_id.cache_clear()
+    group_id.cache_clear()
+    posts = build_posts(rows, on_error)
+    imported = 0
+    while True:
+        batch = list(islice(posts, batch_size))
+        if not batch:
+            return
+        with transaction.atomic():
+            _after_insert(insert_batch(batch))
+        imported += len(batch)
+        yield imported
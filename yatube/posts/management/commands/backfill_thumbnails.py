@@ -0,0 +1,43 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from posts.images import THUMBNAIL_SIZES, build_thumbnails, lookup_thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Достраивает недостающие варианты миниатюр для картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько постов проверять за одно чтение KVStore',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only('pk', 'image').iterator()
+        built = complete = failed = 0
+        while True:
+            batch = list(islice(posts, options['batch_size']))
+            if not batch:
+                break
+            found = lookup_thumbnails(batch)
+            for post in batch:
+                missing = [
+                    size for index, size in enumerate(THUMBNAIL_SIZES)
+                    if (post.pk, index) not in found
+                ]
+                if not missing:
+                    complete += 1
+                    continue
+                try:
+                    build_thumbnails(post.image, missing)
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{post.image.name}: {error}')
+                    continue
+                built += 1
+        self.stdout.write(
+            f'достроено {built}, уже готово {complete}, с ошибкой {failed}'
+        )
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.media_gc import PHASES
+
+
+class Command(BaseCommand):
+    help = ('Удаляет загрузки постов и миниатюры, на которые ничего '
+            'не ссылается')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов проверять и удалять за раз',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.5,
+            help='Пауза в секундах между пачками',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с позицией обхода, чтобы продолжить прерванный запуск',
+        )
+
+    def load_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+
+    def save_checkpoint(self, path, phase, after):
+        with open(path, 'w') as checkpoint:
+            json.dump({'phase': phase, 'after': after}, checkpoint)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        path = options['checkpoint']
+        checkpoint = self.load_checkpoint(path)
+        phases = list(PHASES)
+        start = phases.index(checkpoint['phase']) if checkpoint else 0
+        for phase in phases[start:]:
+            find, remove = PHASES[phase]
+            after = checkpoint.get('after') if phase == phases[start] else None
+            found = size = 0
+            batches = find(after, options['batch_size'], options['min_age'])
+            for position, garbage in batches:
+                for item in garbage:
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{phase}: {item.name}')
+                    if not dry_run:
+                        remove(item)
+                found += len(garbage)
+                size += sum(item.size for item in garbage)
+                if path and not dry_run:
+                    self.save_checkpoint(path, phase, position)
+                time.sleep(options['sleep'])
+            verb = 'к удалению' if dry_run else 'удалено'
+            self.stdout.write(f'{phase}: {verb} {found}, {size} байт')
+        if path and not dry_run and os.path.exists(path):
+            os.remove(path)
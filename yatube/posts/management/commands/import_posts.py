@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import (
+    FORMATS, IMPORT_BATCH_SIZE, ImportNotSupported, import_posts, read_rows,
+)
+
+
+class Command(BaseCommand):
+    help = ('Импортирует посты из JSONL или CSV (поля text, author, group, '
+            'pub_date), недостающие авторы и группы создаются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с постами или - для stdin')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат файла, по умолчанию по расширению',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Сколько постов вставлять одним запросом и транзакцией',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        data_format = options['format']
+        if data_format is None:
+            data_format = os.path.splitext(path)[1].lstrip('.').lower()
+        if data_format not in FORMATS:
+            raise CommandError('Укажите --format: jsonl или csv')
+        skipped = 0
+
+        def on_error(number, error):
+            nonlocal skipped
+            skipped += 1
+            self.stderr.write(f'строка {number}: {error}')
+
+        started = time.monotonic()
+        imported = 0
+        stream = (
+            sys.stdin if path == '-'
+            else open(path, encoding='utf-8', newline='')
+        )
+        try:
+            rows = read_rows(stream, data_format)
+            for imported in import_posts(
+                    rows, on_error, batch_size=options['batch_size']):
+                rate = imported / (time.monotonic() - started)
+                self.stdout.write(f'{imported} постов, {rate:.0f} строк/с')
+        except ImportNotSupported as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Импортировано {imported}, пропущено {skipped} '
+            f'за {elapsed:.1f} с'
+        )
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.images import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры картинок из очереди загрузок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько задач брать из очереди за раз',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=5,
+            help='Пауза в секундах, когда очередь пуста',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = process_jobs(options['batch_size'])
+            if done or failed:
+                self.stdout.write(f'готово {done}, с ошибкой {failed}')
+            if done + failed < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, комментариев и подписок'
+
+    def handle(self, *args, **options):
+        for field, fixed in repair_counters().items():
+            self.stdout.write(f'{field}: исправлено {fixed}')
@@ -0,0 +1,151 @@
+"""Поиск файлов в MEDIA_ROOT, на которые ничего не ссылается.
+
+Каждый этап отдает кандидатов пачками в постоянном порядке, поэтому
+обход можно прервать и продолжить с позиции последней пачки.
+"""
+import os
+import posixpath
+import time
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from sorl.thumbnail import default, delete
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore
+
+from .models import Post
+
+# name - путь файла или ключ KVStore, size - байт на диске.
+Garbage = namedtuple('Garbage', 'name size')
+
+
+def _path_key(name):
+    return tuple(name.split('/'))
+
+
+def walk_media(directory, after=None, min_age=0):
+    """Файлы MEDIA_ROOT/directory по одному каталогу за раз, после after.
+
+    Файлы моложе min_age секунд пропускаются: их могли загрузить, но
+    еще не сохранить ссылку в базе.
+    """
+    after = _path_key(after) if after else None
+    newest = time.time() - min_age
+
+    def walk(relative):
+        try:
+            entries = sorted(
+                os.scandir(os.path.join(settings.MEDIA_ROOT, relative)),
+                key=lambda entry: entry.name,
+            )
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            name = posixpath.join(relative, entry.name)
+            key = _path_key(name)
+            if entry.is_dir(follow_symlinks=False):
+                if after is None or key >= after[:len(key)]:
+                    yield from walk(name)
+            elif after is None or key > after:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime <= newest:
+                    yield Garbage(name, stat.st_size)
+
+    return walk(directory.strip('/'))
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def orphaned_originals(after, batch_size, min_age):
+    """Загрузки постов, на которые не ссылается ни один пост."""
+    upload_to = Post._meta.get_field('image').upload_to
+    files = walk_media(upload_to, after, min_age)
+    for batch in _batches(files, batch_size):
+        referenced = set(
+            Post.objects.filter(
+                image__in=[item.name for item in batch]
+            ).values_list('image', flat=True)
+        )
+        yield batch[-1].name, [
+            item for item in batch if item.name not in referenced
+        ]
+
+
+def stale_sources(after, batch_size, min_age):
+    """Записи KVStore о картинках, которых больше нет у постов."""
+    upload_to = Post._meta.get_field('image').upload_to
+    keys = KVStore.objects.filter(
+        key__startswith=add_prefix('', 'thumbnails')
+    ).order_by('key').values_list('key', flat=True)
+    if after:
+        keys = keys.filter(key__gt=after)
+    for batch in _batches(keys.iterator(), batch_size):
+        sources = {}
+        for key in batch:
+            source = default.kvstore._get(del_prefix(key))
+            if source is not None and source.name.startswith(upload_to):
+                sources[source.name] = key
+        referenced = set(
+            Post.objects.filter(
+                image__in=list(sources)
+            ).values_list('image', flat=True)
+        )
+        yield batch[-1], [
+            Garbage(key, 0) for name, key in sources.items()
+            if name not in referenced
+        ]
+
+
+def stale_thumbnails(after, batch_size, min_age):
+    """Файлы миниатюр, о которых не знает KVStore."""
+    files = walk_media(thumbnail_settings.THUMBNAIL_PREFIX, after, min_age)
+    for batch in _batches(files, batch_size):
+        keys = {
+            add_prefix(ImageFile(item.name, default.storage).key): item
+            for item in batch
+        }
+        known = set(
+            KVStore.objects.filter(
+                key__in=list(keys)
+            ).values_list('key', flat=True)
+        )
+        yield batch[-1].name, [
+            item for key, item in keys.items() if key not in known
+        ]
+
+
+def remove_original(item):
+    # Ссылка могла появиться после проверки: загрузили то же содержимое.
+    if not Post.objects.filter(image=item.name).exists():
+        delete(Post(image=item.name).image)
+
+
+def remove_source(item):
+    source = default.kvstore._get(del_prefix(item.name))
+    if source is None:
+        default.kvstore._delete(del_prefix(item.name), identity='thumbnails')
+    else:
+        default.kvstore.delete(source)
+
+
+def remove_thumbnail(item):
+    default.storage.delete(item.name)
+
+
+# Порядок важен: удаление исходников и записей KVStore делает
+# их миниатюры мусором для последнего этапа.
+PHASES = {
+    'originals': (orphaned_originals, remove_original),
+    'sources': (stale_sources, remove_source),
+    'thumbnails': (stale_thumbnails, remove_thumbnail),
+}
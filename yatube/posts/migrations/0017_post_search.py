@@ -0,0 +1,34 @@
+from django.db import migrations
+
+CREATE_INDEX = '''
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    text, tokenize = 'unicode61 remove_diacritics 2'
+)
+'''
+FILL_INDEX = '''
+INSERT INTO posts_post_fts (rowid, text) SELECT id, text FROM posts_post
+'''
+
+
+def create_index(apps, schema_editor):
+    # FTS5 есть только в SQLite, на других базах поиск идет без индекса.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    schema_editor.execute(FILL_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_image_content_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
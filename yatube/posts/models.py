@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from core.models import AtomicSaveModel, CreatedModel
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -13,9 +16,10 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class Post(AtomicSaveModel):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -31,17 +35,45 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        db_index=True,
     )
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Счетчик меняется только через update() с F(): полное сохранение
+        # устаревшего объекта затерло бы чужие прибавления.
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'comments_count'
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.text[:15]
 
 
-class Comment(models.Model):
+class Comment(AtomicSaveModel):
     post = models.ForeignKey(
         Post, on_delete=models.CASCADE,
         related_name='comments'
@@ -58,11 +90,20 @@ class Comment(models.Model):
         verbose_name='Дата публикации', auto_now_add=True
     )
 
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx',
+            )
+        ]
+
     def __str__(self):
         return self.text[:15]
 
 
-class Follow(models.Model):
+class Follow(AtomicSaveModel):
     user = models.ForeignKey(
         User,
         related_name='follower',
@@ -81,3 +122,80 @@ class Follow(models.Model):
                 name='unique_following',
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx',
+            )
+        ]
+
+
+class UserStats(models.Model):
+    """Счетчики пользователя, которые обновляются вместе с записями."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Посты автора не раскладываются по лентам, а читаются при запросе.
+    celebrity = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'Счетчики {self.user_id}'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост, разложенный подписчику."""
+    user = models.ForeignKey(
+        User,
+        related_name='timeline',
+        on_delete=models.CASCADE,
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name='timeline_entries',
+        on_delete=models.CASCADE,
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx',
+            )
+        ]
+
+
+class ThumbnailJob(CreatedModel):
+    """Очередь построения миниатюр для загруженной картинки поста."""
+    post = models.ForeignKey(
+        Post,
+        related_name='thumbnail_jobs',
+        on_delete=models.CASCADE,
+    )
+    image = models.CharField('Картинка', max_length=100)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'image'],
+                name='unique_thumbnail_job',
+            )
+        ]
+
+    def __str__(self):
+        return self.image
@@ -0,0 +1,267 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete,
+)
+from django.dispatch import receiver
+
+from . import autocomplete, counters, images, search, timeline
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .ulits import (
+    bump_feed_versions, invalidate_feed_counts, post_refs_key,
+    remember_post_refs,
+)
+
+
+def post_feeds(post):
+    """Ленты, в которых пост виден сейчас или был виден до правки."""
+    feeds = {'index', f'profile:{post.author.username}'}
+    if post.group_id is not None:
+        feeds.add(f'group:{post.group.slug}')
+    initial_group_id = post._initial_group_id
+    if initial_group_id not in (None, post.group_id):
+        feeds.update(
+            f'group:{slug}' for slug in Group.objects.filter(
+                pk=initial_group_id
+            ).values_list('slug', flat=True)
+        )
+    return feeds
+
+
+def author_feeds(user):
+    """Ленты с карточками автора: в них его имя и ссылка на профиль.
+
+    Профиль берется и под прежним логином, чтобы старый адрес не
+    отдавался из кеша.
+    """
+    names = {user.username, user._initial_username} - {None}
+    feeds = {f'profile:{name}' for name in names}
+    if Post.objects.filter(author_id=user.pk).exists():
+        feeds.add('index')
+        feeds.update(
+            f'group:{slug}' for slug in Group.objects.filter(
+                posts__author_id=user.pk
+            ).values_list('slug', flat=True).distinct()
+        )
+    return feeds
+
+
+def group_feeds(group, profiles=False):
+    """Ленты с названием или ссылками группы, прежний слаг тоже.
+
+    profiles - добавить профили авторов группы: в их карточках ссылка
+    на группу по слагу.
+    """
+    slugs = {group.slug, group._initial_slug} - {None}
+    feeds = {'index', f'card-group:{group.pk}'}
+    feeds.update(f'group:{slug}' for slug in slugs)
+    if profiles:
+        feeds.update(
+            f'profile:{name}' for name in User.objects.filter(
+                posts__group=group
+            ).values_list('username', flat=True).distinct()
+        )
+    return feeds
+
+
+def names_changed(update_fields):
+    """Могли ли измениться имена пользователя при сохранении."""
+    # Вход пользователя сохраняет только last_login.
+    return not update_fields or bool(
+        {'username', 'first_name', 'last_name'} & set(update_fields)
+    )
+
+
+@receiver(post_init, sender=Post)
+def remember_initial(sender, instance, **kwargs):
+    # Через __dict__, чтобы не загружать отложенные поля.
+    instance._initial_group_id = instance.__dict__.get('group_id')
+    image = instance.__dict__.get('image')
+    instance._initial_image = image if isinstance(image, str) else None
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_init, sender=User)
+def remember_initial_username(sender, instance, **kwargs):
+    instance._initial_username = instance.__dict__.get('username')
+
+
+@receiver(post_init, sender=Group)
+def remember_initial_slug(sender, instance, **kwargs):
+    instance._initial_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def expire_profile_pages(sender, instance, update_fields=None, **kwargs):
+    if names_changed(update_fields):
+        bump_feed_versions(*author_feeds(instance))
+    instance._initial_username = instance.username
+
+
+@receiver(post_save, sender=User)
+def expire_author_cards(sender, instance, update_fields=None, **kwargs):
+    if names_changed(update_fields):
+        bump_feed_versions(
+            f'card-author:{instance.pk}', f'author:{instance.pk}'
+        )
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.bump_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, followers_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.promote(instance.author_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    timeline.trim(instance.user_id, instance.author_id)
+    if timeline.demote(instance.author_id):
+        # Раскладка большая, ее не стоит держать в транзакции отписки.
+        author_id = instance.author_id
+        transaction.on_commit(
+            lambda: timeline.fan_out_former_celebrity(author_id)
+        )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def expire_post_feeds(sender, instance, signal, created=False, **kwargs):
+    feeds = post_feeds(instance)
+    if (signal is post_delete or created
+            or instance.group_id != instance._initial_group_id):
+        invalidate_feed_counts(*feeds)
+        if signal is post_delete:
+            cache.delete(post_refs_key(instance.pk))
+        else:
+            remember_post_refs(instance)
+    if signal is post_delete or created:
+        # Число постов в сайдбаре страниц постов автора.
+        feeds.add(f'author:{instance.author_id}')
+    bump_feed_versions(*feeds, f'post:{instance.pk}')
+    instance._initial_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def refresh_follow_feed_count(sender, instance, **kwargs):
+    invalidate_feed_counts(f'follow:{instance.user_id}')
+    # На странице профиля выводятся счетчики подписок.
+    bump_feed_versions(
+        f'profile:{instance.author.username}',
+        f'profile:{instance.user.username}',
+    )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_comment_pages(sender, instance, **kwargs):
+    bump_feed_versions(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+def expire_group_pages(sender, instance, created, **kwargs):
+    slug_changed = not created and instance.slug != instance._initial_slug
+    bump_feed_versions(*group_feeds(instance, profiles=slug_changed))
+    instance._initial_slug = instance.slug
+
+
+@receiver(pre_delete, sender=Group)
+def expire_deleted_group_pages(sender, instance, **kwargs):
+    # До удаления: потом у постов группы уже будет group=None.
+    bump_feed_versions(*group_feeds(instance, profiles=True))
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    initial_image = instance._initial_image
+    if initial_image and initial_image != instance.image.name:
+        transaction.on_commit(lambda: images.release_image(initial_image))
+    instance._initial_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: images.release_image(name))
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, **kwargs):
+    if search.fts_supported():
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    if search.fts_supported():
+        search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_user_names(sender, instance, update_fields=None, **kwargs):
+    if names_changed(update_fields):
+        autocomplete.index.update(autocomplete.USER, instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user_names(sender, instance, **kwargs):
+    autocomplete.index.remove(autocomplete.USER, instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def index_group_names(sender, instance, **kwargs):
+    autocomplete.index.update(autocomplete.GROUP, instance)
+
+
+@receiver(post_delete, sender=Group)
+def unindex_group_names(sender, instance, **kwargs):
+    autocomplete.index.remove(autocomplete.GROUP, instance.pk)
@@ -0,0 +1,68 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from posts.images import prefetch_thumbnails
+from posts.ulits import feed_versions
+
+register = template.Library()
+
+CARD_TEMPLATE: str = 'includes/post_feed_card.html'
+PICTURE_TEMPLATE: str = 'includes/post_picture.html'
+CARD_CACHE_TIMEOUT: int = 60 * 60
+
+
+def author_card(post):
+    return f'card-author:{post.author_id}'
+
+
+def group_card(post):
+    return f'card-group:{post.group_id}'
+
+
+def card_key(post, display_group_link, full_text, versions):
+    """Ключ меняется при правке поста, его автора или группы:
+    в карточке их имена и ссылки."""
+    version = int(post.updated.timestamp() * 1000000)
+    author = versions[author_card(post)]
+    group = versions[group_card(post)] if post.group_id else 0
+    return (f'post_card:{post.pk}:{version}:{author}:{group}:'
+            f'{int(bool(display_group_link))}:{int(bool(full_text))}')
+
+
+@register.simple_tag
+def post_cards(posts, display_group_link=False, full_text=False):
+    """Карточки постов страницы: кеш читается одним get_many,
+    рендерятся только промахи. full_text - текст без сокращения."""
+    versions = feed_versions(
+        *{author_card(post) for post in posts},
+        *{group_card(post) for post in posts if post.group_id},
+    )
+    keys = {
+        card_key(post, display_group_link, full_text, versions): post
+        for post in posts
+    }
+    cards = cache.get_many(keys)
+    prefetch_thumbnails(
+        [post for key, post in keys.items() if key not in cards]
+    )
+    rendered = {
+        key: render_to_string(CARD_TEMPLATE, {
+            'post': post,
+            'display_group_link': display_group_link,
+            'full_text': full_text,
+        })
+        for key, post in keys.items() if key not in cards
+    }
+    if rendered:
+        cache.set_many(rendered, CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+    return [cards[key] for key in keys]
+
+
+@register.inclusion_tag(PICTURE_TEMPLATE)
+def post_picture(post):
+    """Картинка поста с вариантами для srcset."""
+    if not hasattr(post, 'thumbnail_sources'):
+        prefetch_thumbnails([post])
+    return {'post': post}
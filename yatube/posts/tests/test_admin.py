@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Group, Post
+
+User = get_user_model()
+
+
+class PostAdminTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='admin-slug', description='Описание'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:posts_post_changelist')
+
+    def get_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def create_posts(self, count):
+        for number in range(count):
+            Post.objects.create(
+                author=self.admin, group=self.group, text=f'Пост {number}'
+            )
+
+    def test_changelist_queries_do_not_grow(self):
+        """Список постов не делает запросов на каждую строку."""
+        self.create_posts(2)
+        _, before = self.get_queries(self.url)
+        self.create_posts(20)
+        cache.clear()
+        response, after = self.get_queries(self.url)
+        self.assertEqual(len(before), len(after))
+        self.assertContains(
+            response,
+            f'<option value="{self.group.pk}" selected>{self.group}</option>',
+            count=Post.objects.count(),
+        )
+
+    def test_count_comes_from_cache(self):
+        """Повторный показ списка не считает записи заново."""
+        self.create_posts(3)
+        self.get_queries(self.url)
+        response, queries = self.get_queries(self.url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertFalse(
+            [sql for sql in queries if 'COUNT(' in sql.upper()]
+        )
+
+    def test_search_uses_fulltext_index(self):
+        """Поиск в админке идет через FTS-индекс."""
+        Post.objects.create(author=self.admin, text='Про котиков')
+        Post.objects.create(author=self.admin, text='Про собак')
+        response, queries = self.get_queries(f'{self.url}?q=котик')
+        self.assertEqual(
+            [post.text for post in response.context['cl'].result_list],
+            ['Про котиков'],
+        )
+        self.assertTrue([sql for sql in queries if 'MATCH' in sql])
+        self.assertFalse([sql for sql in queries if 'LIKE' in sql])
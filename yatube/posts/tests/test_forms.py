@@ -1,12 +1,31 @@
+import json
+import os
 import shutil
 import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings
+)
 from django.urls import reverse
-from ..models import Post, Group, Comment
+from .. import images
+from ..forms import PostForm
+from ..images import (
+    CARD_THUMBNAIL, CARD_VARIANTS, CARD_WIDTHS, MAX_ATTEMPTS, MAX_IMAGE_SIDE,
+    RELEASE_GRACE, THUMBNAIL_SIZES, build_thumbnails, prefetch_thumbnails,
+    process_jobs,
+)
+from ..models import Post, Group, Comment, ThumbnailJob
 from django.conf import settings
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
 
 User = get_user_model()
 
@@ -149,3 +168,327 @@ class CreateFormTests(TestCase):
         )
         self.assertEqual(response.context['comments'][0].text,
                          form_data['text'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='thumbuser')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # KVStore sorl в кеше помнит миниатюры, удаленные прошлыми тестами.
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def create_post_with_image(self, color=None):
+        # Разный цвет - разное содержимое, иначе файлы совпадут.
+        if color is None:
+            color = (Post.objects.count() % 256, 0, 0)
+        content = BytesIO()
+        Image.new('RGB', (2, 1), color).save(content, 'GIF')
+        uploaded = SimpleUploadedFile(
+            name='queued.gif',
+            content=content.getvalue(),
+            content_type='image/gif'
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С картинкой', 'image': uploaded},
+        )
+        return Post.objects.filter(text='С картинкой').latest('pk')
+
+    def test_upload_queues_and_worker_builds_thumbnails(self):
+        """Загрузка ставит задачу, воркер строит миниатюры и чистит очередь."""
+        post = self.create_post_with_image()
+        self.assertTrue(
+            ThumbnailJob.objects.filter(
+                post=post, image=post.image.name
+            ).exists()
+        )
+        with mock.patch(
+            'posts.images.build_thumbnails',
+            wraps=images.build_thumbnails,
+        ) as build_thumbnails:
+            call_command('process_thumbnails', '--once', stdout=mock.Mock())
+        build_thumbnails.assert_called_once_with(post.image)
+        self.assertFalse(ThumbnailJob.objects.exists())
+
+    def test_api_lists_built_thumbnails(self):
+        """API отдает ссылки на миниатюры, как только воркер их построил."""
+        post = self.create_post_with_image()
+        url = reverse('posts:api_post', args=[post.pk])
+        self.assertEqual(self.client.get(url).json()['thumbnails'], [])
+        call_command('process_thumbnails', '--once', stdout=mock.Mock())
+        thumbnails = self.client.get(url).json()['thumbnails']
+        self.assertEqual(
+            len(thumbnails), len(images.THUMBNAIL_SIZES)
+        )
+        for thumbnail in thumbnails:
+            self.assertTrue(
+                thumbnail['url'].startswith(settings.MEDIA_URL)
+            )
+
+    def test_failed_job_is_retried_then_dropped(self):
+        """Задача с ошибкой остается в очереди до MAX_ATTEMPTS попыток."""
+        self.create_post_with_image()
+        with mock.patch(
+            'posts.images.build_thumbnails', side_effect=OSError('broken')
+        ):
+            self.assertEqual(process_jobs(10), (0, 1))
+            self.assertEqual(ThumbnailJob.objects.get().error, 'broken')
+            for _ in range(MAX_ATTEMPTS - 1):
+                process_jobs(10)
+        self.assertFalse(ThumbnailJob.objects.exists())
+
+    def test_prefetch_thumbnails_reads_store_in_bulk(self):
+        """Миниатюры страницы читаются из KVStore одним запросом."""
+        posts = [self.create_post_with_image() for _ in range(3)]
+        posts.append(Post.objects.create(author=self.user, text='Без'))
+        for post in posts[:2]:
+            build_thumbnails(post.image)
+        cache.clear()
+        with self.assertNumQueries(1):
+            prefetch_thumbnails(posts)
+        with self.assertNumQueries(0):
+            prefetch_thumbnails(posts)
+        for post in posts[:2]:
+            self.assertEqual(
+                post.thumbnail.url,
+                get_thumbnail(post.image, '960x339', crop='center',
+                              upscale=True).url,
+            )
+            self.assertEqual(post.thumbnail.width, 960)
+            self.assertEqual(
+                [source['type'] for source in post.thumbnail_sources],
+                list(CARD_VARIANTS),
+            )
+        self.assertIsNone(posts[2].thumbnail)
+        self.assertIsNone(posts[3].thumbnail)
+
+    def test_backfill_builds_only_missing_variants(self):
+        """Бэкфилл строит недостающие варианты и пропускает готовые."""
+        ready = self.create_post_with_image()
+        build_thumbnails(ready.image)
+        partial = self.create_post_with_image()
+        build_thumbnails(partial.image, [CARD_THUMBNAIL])
+        out = StringIO()
+        with mock.patch(
+            'posts.management.commands.backfill_thumbnails.build_thumbnails',
+            wraps=build_thumbnails,
+        ) as build:
+            call_command('backfill_thumbnails', stdout=out)
+        missing = [size for size in THUMBNAIL_SIZES if size != CARD_THUMBNAIL]
+        build.assert_called_once_with(partial.image, missing)
+        self.assertIn('достроено 1, уже готово 1', out.getvalue())
+        prefetch_thumbnails([partial])
+        srcset = partial.thumbnail_sources[-1]['srcset']
+        for width in CARD_WIDTHS:
+            self.assertIn(f' {width}w', srcset)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageNormalizationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, size, image_format='JPEG', **save_options):
+        content = BytesIO()
+        Image.new('RGB', size, (200, 10, 10)).save(
+            content, image_format, **save_options
+        )
+        return SimpleUploadedFile(
+            name='photo.jpg', content=content.getvalue(),
+            content_type='image/jpeg',
+        )
+
+    def test_large_upload_is_downscaled_without_exif(self):
+        """Большое фото уменьшается и теряет EXIF при загрузке."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Фото',
+                'image': self.upload((4000, 1000), exif=exif.tobytes()),
+            },
+        )
+        post = Post.objects.get(text='Фото')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (MAX_IMAGE_SIDE, 480))
+            self.assertEqual(image.format, 'JPEG')
+            self.assertNotIn('exif', image.info)
+
+    def test_decompression_bomb_is_rejected(self):
+        """Картинка сверх лимита пикселей отклоняется до декодирования."""
+        form = PostForm(
+            data={'text': 'Бомба'},
+            files={'image': self.upload((3000, 3000), 'PNG')},
+        )
+        with mock.patch('posts.images.MAX_IMAGE_PIXELS', 1000 * 1000):
+            self.assertFalse(form.is_valid())
+        self.assertIn('пикселей', form.errors['image'][0])
+
+    def test_truncated_upload_is_rejected(self):
+        """Обрезанный JPEG - ошибка формы, а не падение."""
+        content = self.upload((400, 300)).read()
+        upload = SimpleUploadedFile(
+            name='photo.jpg', content=content[:len(content) // 2],
+            content_type='image/jpeg',
+        )
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Обрезанное', 'image': upload},
+        )
+        self.assertEqual(response.status_code, 200)
+        errors = response.context['form'].errors['image']
+        self.assertIn('повреждена', errors[0])
+        self.assertFalse(Post.objects.filter(text='Обрезанное').exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TransactionTestCase):
+    create_post_with_image = ThumbnailQueueTests.create_post_with_image
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='dedup')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def age(self, path):
+        """Делает файл старше RELEASE_GRACE."""
+        past = time.time() - RELEASE_GRACE - 1
+        os.utime(path, (past, past))
+
+    def test_same_content_is_stored_once(self):
+        """Одинаковые загрузки делят файл, он удаляется с последним постом."""
+        first = self.create_post_with_image(color=(1, 2, 3))
+        second = self.create_post_with_image(color=(1, 2, 3))
+        self.assertEqual(first.image.name, second.image.name)
+        storage = first.image.storage
+        self.assertEqual(
+            len(storage.listdir(os.path.dirname(first.image.name))[1]), 1
+        )
+        self.age(second.image.path)
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+
+    def test_fresh_file_survives_release(self):
+        """Файл, который только что загрузили повторно, не удаляется:
+        пост с ним мог еще не сохраниться."""
+        first = self.create_post_with_image(color=(11, 12, 13))
+        self.age(first.image.path)
+        second = self.create_post_with_image(color=(11, 12, 13))
+        name = second.image.name
+        Post.objects.filter(pk=second.pk).delete()
+        first.delete()
+        self.assertTrue(first.image.storage.exists(name))
+
+    def test_replaced_image_is_released(self):
+        """Замененная при правке картинка удаляется, если больше не нужна."""
+        post = self.create_post_with_image(color=(4, 5, 6))
+        old_name = post.image.name
+        self.age(post.image.path)
+        content = BytesIO()
+        Image.new('RGB', (2, 1), (7, 8, 9)).save(content, 'GIF')
+        self.authorized_client.post(
+            reverse('posts:edit', kwargs={'post_id': post.pk}),
+            data={
+                'text': post.text,
+                'image': SimpleUploadedFile('new.gif', content.getvalue()),
+            },
+        )
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        self.assertFalse(post.image.storage.exists(old_name))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaTests(TestCase):
+    create_post_with_image = ThumbnailQueueTests.create_post_with_image
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='collector')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.post = self.create_post_with_image(color=(10, 20, 30))
+        build_thumbnails(self.post.image)
+        self.storage = self.post.image.storage
+        self.orphan = self.storage.save('posts/orphan.txt', ContentFile(b'1'))
+        self.stale = default.storage.save(
+            'cache/zz/zz/stale.jpg', ContentFile(b'2')
+        )
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command(
+            'collect_media', '--min-age=0', '--sleep=0', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def assertKept(self, *names):
+        for name in names:
+            with self.subTest(name=name):
+                self.assertTrue(self.storage.exists(name))
+
+    def test_dry_run_only_reports(self):
+        """Пробный запуск находит мусор, но ничего не удаляет."""
+        report = self.collect('--dry-run')
+        self.assertIn('originals: к удалению 1, 1 байт', report)
+        self.assertIn('thumbnails: к удалению 1, 1 байт', report)
+        self.assertKept(self.orphan, self.stale)
+
+    def test_collects_only_unreferenced_files(self):
+        """Удаляются ничейные загрузки и миниатюры, нужные остаются."""
+        self.collect('--batch-size=1')
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertFalse(self.storage.exists(self.stale))
+        prefetch_thumbnails([self.post])
+        self.assertKept(self.post.image.name, self.post.thumbnail.name)
+
+    def test_resumes_from_checkpoint(self):
+        """Запуск продолжается с этапа и позиции из файла отметки."""
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'gc.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({'phase': 'thumbnails', 'after': 'cache/zz'}, file)
+        self.collect(f'--checkpoint={checkpoint}')
+        self.assertKept(self.orphan)
+        self.assertFalse(self.storage.exists(self.stale))
+        self.assertFalse(os.path.exists(checkpoint))
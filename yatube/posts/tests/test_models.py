@@ -1,7 +1,18 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.urls import reverse
 
-from ..models import Group, Post
+from ..models import Comment, Follow, Group, Post, UserStats
+from ..importer import import_posts
+from ..search import SearchResults
 
 User = get_user_model()
 
@@ -30,3 +41,178 @@ class PostModelTest(TestCase):
         for expected_object_name, obj_model in object_title.items():
             with self.subTest(object=obj_model):
                 self.assertEqual(expected_object_name, str(obj_model))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+
+    def assertStats(self, user, **expected):
+        stats = UserStats.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(user=user, field=field):
+                self.assertEqual(getattr(stats, field), value)
+
+    def test_counters_follow_writes(self):
+        """Счетчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertStats(self.author, posts_count=1, followers_count=1)
+        self.assertStats(self.reader, following_count=1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertStats(self.author, followers_count=0)
+        self.assertStats(self.reader, following_count=0)
+        post.delete()
+        self.assertStats(self.author, posts_count=0)
+
+    def test_stale_save_keeps_comments_count(self):
+        """Сохранение загруженного ранее поста не затирает счетчик."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        stale = Post.objects.get(pk=post.pk)
+        Comment.objects.create(post=post, author=self.reader, text='-')
+        stale.text = 'Правка'
+        stale.save()
+        post.refresh_from_db()
+        self.assertEqual((post.text, post.comments_count), ('Правка', 1))
+
+    def test_recount_counters_repairs_drift(self):
+        """Команда recount_counters исправляет разошедшиеся счетчики."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='-')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.update(
+            posts_count=7, followers_count=7, following_count=7
+        )
+        Post.objects.update(comments_count=7)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertStats(
+            self.author, posts_count=1, followers_count=1, following_count=0
+        )
+        self.assertStats(
+            self.reader, posts_count=0, followers_count=0, following_count=1
+        )
+
+
+class ImportPostsTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='existing')
+        self.follower = User.objects.create_user(username='reader')
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        """JSONL импортируется пачками с датами, авторами и группами."""
+        rows = [
+            {'text': 'Первый', 'author': 'existing', 'group': 'news',
+             'pub_date': '2020-01-02T03:04:05+00:00'},
+            {'text': 'Второй', 'author': 'newcomer'},
+            {'text': '', 'author': 'existing'},
+            {'text': 'Третий', 'author': 'existing', 'group': 'news'},
+        ]
+        path = self.write(
+            'posts.jsonl',
+            '\n'.join(json.dumps(row) for row in rows) + '\n{broken\n',
+        )
+        out, err = StringIO(), StringIO()
+        call_command('import_posts', path, '--batch-size=2',
+                     stdout=out, stderr=err)
+        self.assertIn('Импортировано 3, пропущено 2', out.getvalue())
+        self.assertIn('строка 5', err.getvalue())
+        first = Post.objects.get(text='Первый')
+        self.assertEqual(first.pub_date.year, 2020)
+        self.assertEqual(first.group.slug, 'news')
+        self.assertEqual(Group.objects.filter(slug='news').count(), 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 2
+        )
+        self.assertEqual(
+            UserStats.objects.get(user__username='newcomer').posts_count, 1
+        )
+        self.assertEqual(self.follower.timeline.count(), 2)
+        self.assertEqual(len(SearchResults('третий')[0:10]), 1)
+
+    def test_import_cyrillic_group(self):
+        """Группа с русским названием получает латинский slug."""
+        Group.objects.create(title='Новости', slug='news')
+        rows = [
+            {'text': 'В новостях', 'author': 'existing', 'group': 'Новости'},
+            {'text': 'О спорте', 'author': 'existing', 'group': 'Спорт'},
+            {'text': 'Пусто', 'author': 'existing', 'group': '!!!'},
+        ]
+        path = self.write(
+            'posts.jsonl', '\n'.join(json.dumps(row) for row in rows)
+        )
+        err = StringIO()
+        call_command('import_posts', path, stdout=StringIO(), stderr=err)
+        news = Post.objects.get(text='В новостях').group
+        self.assertEqual(news.slug, 'news')
+        sport = Post.objects.get(text='О спорте').group
+        self.assertEqual((sport.slug, sport.title), ('sport', 'Спорт'))
+        self.assertIn('строка 3', err.getvalue())
+        self.assertEqual(
+            self.client.get(reverse('posts:index')).status_code, 200
+        )
+
+    def test_posts_between_batches_stay_separate(self):
+        """Посты, созданные между пачками, не путаются с импортом."""
+        rows = [
+            {'text': f'Импорт {number}', 'author': 'existing',
+             'pub_date': '2020-01-02T03:04:05+00:00'}
+            for number in range(4)
+        ]
+        field = Post._meta.get_field('pub_date')
+        for _ in import_posts(rows, mock.Mock(), batch_size=2):
+            self.assertTrue(field.auto_now_add)
+            Post.objects.create(author=self.follower, text='Параллельный')
+        self.assertEqual(
+            set(Post.objects.filter(
+                text__startswith='Импорт'
+            ).values_list('pub_date__year', flat=True)),
+            {2020},
+        )
+        self.assertFalse(Post.objects.filter(
+            text='Параллельный', pub_date__year=2020
+        ).exists())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 4
+        )
+        self.assertEqual(self.follower.timeline.count(), 4)
+
+    def test_unsupported_database_is_refused(self):
+        """На базе, не отдающей id вставленных строк, импорт не идет."""
+        path = self.write('posts.jsonl', '{"text": "-", "author": "x"}\n')
+        with mock.patch('posts.importer.connection') as connection:
+            connection.vendor = 'mysql'
+            connection.features.can_return_ids_from_bulk_insert = False
+            with self.assertRaises(CommandError):
+                call_command('import_posts', path, stdout=StringIO())
+        self.assertFalse(Post.objects.filter(text='-').exists())
+
+    def test_import_csv(self):
+        """CSV читается по заголовку."""
+        path = self.write(
+            'posts.csv', 'author,text,group\nexisting,"Из, CSV",\n'
+        )
+        call_command('import_posts', path, stdout=StringIO())
+        post = Post.objects.get(author=self.author)
+        self.assertEqual(post.text, 'Из, CSV')
+        self.assertIsNone(post.group)
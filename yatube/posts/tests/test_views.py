@@ -1,14 +1,35 @@
+import base64
+import csv
+import json
 import shutil
 import tempfile
+import warnings
+from io import StringIO
+from unittest import mock, skipUnless
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client, override_settings
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings,
+)
 from django import forms
-from posts.models import Group, Post, Follow
+from posts.models import (
+    Comment, Follow, Group, Post, TimelineEntry, UserStats,
+)
+from posts.timeline import FANOUT_FOLLOWERS_LIMIT
+from posts import autocomplete
+from posts.templatetags import post_cards
+from posts.tests.utils import QueryBudgetMixin
+from posts.ulits import (
+    COMMENTS_PAGE, COUNT_PAGE, NEWER, OLDER, CachedCountPaginator,
+    encode_cursor, feed_count_key,
+)
 from django.conf import settings
 from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -228,9 +249,47 @@ class PostPagesTests(TestCase):
         cache.clear()
         response_with = self.client.get(reverse("posts:index"))
         self.assertIn(new_post, response_with.context["page_obj"])
+        # Правка в обход сигналов не сбрасывает кеш.
+        Post.objects.filter(pk=new_post.pk).update(text="Тихая правка.")
+        response_cached = self.client.get(reverse("posts:index"))
+        self.assertEqual(response_with.content, response_cached.content)
+        # Удаление поста сбрасывает кеш сразу, без ожидания TTL.
         new_post.delete()
         response_without = self.client.get(reverse("posts:index"))
-        self.assertEqual(response_with.content, response_without.content)
+        self.assertNotIn(new_post, response_without.context["page_obj"])
+        self.assertNotEqual(response_with.content, response_without.content)
+
+    def test_cached_pages_render_user_specific_parts(self):
+        """Кеш общий для всех, а шапка и формы свои у каждого."""
+        reader = User.objects.create_user(username='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        cache.clear()
+        for url in urls:
+            with self.subTest(url=url):
+                self.guest_client.get(url)
+                self.authorized_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        for url in urls:
+            with self.subTest(url=url):
+                guest_page = self.guest_client.get(url).content.decode()
+                self.assertIn('Тестовый пост', guest_page)
+                self.assertNotIn('Пользователь:', guest_page)
+                reader_page = reader_client.get(url).content.decode()
+                self.assertIn('Тестовый пост', reader_page)
+                self.assertIn('Пользователь: reader', reader_page)
+                self.assertNotIn('Пользователь: author', reader_page)
+        comment_form = reverse(
+            'posts:add_comment', kwargs={'post_id': self.post.pk}
+        )
+        self.assertContains(reader_client.get(urls[-1]), comment_form)
+        self.assertNotContains(self.guest_client.get(urls[-1]), comment_form)
 
 
 class FollowTests(TestCase):
@@ -273,6 +332,119 @@ class FollowTests(TestCase):
         response = self.authorized_client.get(reverse('posts:follow_index'))
         self.assertIn(post, response.context.get('page_obj').object_list)
 
+    def test_follow_backfills_and_unfollow_trims_timeline(self):
+        """Подписка переносит посты автора в ленту, отписка убирает."""
+        cache.clear()
+        post = Post.objects.create(text='Старый пост', author=self.author)
+        self.authorized_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'author'})
+        )
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow', kwargs={'username': 'author'})
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    @mock.patch('posts.timeline.FANOUT_FOLLOWERS_LIMIT', 0)
+    def test_celebrity_posts_read_on_request(self):
+        """Посты популярных авторов подмешиваются в ленту при чтении."""
+        cache.clear()
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(
+            text='Пост знаменитости', author=self.author
+        )
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context.get('page_obj').object_list)
+
+    @mock.patch('posts.timeline.FANOUT_FOLLOWERS_LIMIT', 1)
+    def test_celebrity_posts_merged_in_order(self):
+        """Лента со знаменитостью листается по порядку и без повторов."""
+        cache.clear()
+        plain = User.objects.create_user(username='plain')
+        fan = User.objects.create_user(username='fan')
+        for follower, author in ((self.user, self.author),
+                                 (fan, self.author), (self.user, plain)):
+            Follow.objects.create(user=follower, author=author)
+        for number in range(COUNT_PAGE + 3):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=self.author if number % 2 else plain,
+            )
+        # Пост, разложенный еще до того, как автор стал знаменитостью.
+        old = Post.objects.filter(author=self.author).last()
+        TimelineEntry.objects.create(
+            user=self.user, post=old, pub_date=old.pub_date
+        )
+        expected = list(Post.objects.all())
+        url = reverse('posts:follow_index')
+        pages = [
+            self.authorized_client.get(url, {'page': number})
+            .context['page_obj'] for number in (1, 2)
+        ]
+        self.assertEqual(pages[0].paginator.count, len(expected))
+        self.assertEqual(
+            pages[0].object_list + pages[1].object_list, expected
+        )
+        first = self.authorized_client.get(url, {'cursor': ''})
+        second = self.authorized_client.get(
+            url, {'cursor': first.context['page_obj'].next_cursor}
+        )
+        self.assertEqual(
+            list(first.context['page_obj'])
+            + list(second.context['page_obj']),
+            expected,
+        )
+        response = self.authorized_client.get(
+            reverse('posts:api_follow_new'),
+            {'cursor': second.context['page_obj'].previous_cursor},
+        )
+        self.assertEqual(response.json()['ids'],
+                         [post.pk for post in expected[:COUNT_PAGE]])
+
+
+class FormerCelebrityTests(TransactionTestCase):
+    """Раскладка после отписки идет после коммита, нужны транзакции."""
+
+    def setUp(self):
+        limits = {
+            'FANOUT_FOLLOWERS_LIMIT': 2,
+            'FANOUT_FOLLOWERS_RESUME': 1,
+            'FANOUT_RESUME_POSTS': 1,
+        }
+        for name, value in limits.items():
+            patcher = mock.patch(f'posts.timeline.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.author = User.objects.create_user(username='author')
+        self.fans = [
+            User.objects.create_user(username=f'fan{number}')
+            for number in range(3)
+        ]
+        for fan in self.fans:
+            Follow.objects.create(user=fan, author=self.author)
+        self.posts = [
+            Post.objects.create(text=f'Пост {number}', author=self.author)
+            for number in range(2)
+        ]
+
+    def test_former_celebrity_posts_fanned_out(self):
+        """Ниже нижней границы новейшие посты автора раскладываются."""
+        self.assertFalse(TimelineEntry.objects.exists())
+        Follow.objects.filter(user=self.fans[0]).delete()
+        # Между границами автор остается знаменитостью.
+        self.assertFalse(TimelineEntry.objects.exists())
+        Follow.objects.filter(user=self.fans[1]).delete()
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', 'post')),
+            [(self.fans[2].pk, self.posts[-1].pk)],
+        )
+        Follow.objects.create(user=self.fans[1], author=self.author)
+        Follow.objects.filter(user=self.fans[1]).delete()
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -311,3 +483,954 @@ class PaginatorViewsTest(TestCase):
             response = self.client.get(adress)
             amount = len(response.context['page_obj'])
             self.assertEqual(amount, count)
+
+    def test_elided_page_range(self):
+        """Навигация показывает края и окно вокруг текущей страницы."""
+        paginator = CachedCountPaginator(list(range(1000)), COUNT_PAGE)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(50)),
+            [1, '…', 48, 49, 50, 51, 52, '…', 100],
+        )
+
+    def test_cached_count_refreshed_by_new_post(self):
+        """Число постов берется из кеша и сбрасывается новым постом."""
+        cache.clear()
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 13)
+        self.assertEqual(cache.get(feed_count_key('index')), 13)
+        Post.objects.create(author=self.author, text='Новый пост')
+        self.assertIsNone(cache.get(feed_count_key('index')))
+        response = self.client.get(reverse('posts:profile', kwargs={
+            'username': self.author.username
+        }))
+        self.assertEqual(response.context['page_obj'].paginator.count, 14)
+
+    def test_cursor_paginator(self):
+        """Курсорная пагинация листает ленты без пропусков и повторов."""
+        cache.clear()
+        context = {'username': self.author.username}
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs=context),
+            reverse('posts:group_list', kwargs={'slug': self.slug}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.client.get(
+                    url, {'cursor': ''}
+                ).context['page_obj']
+                self.assertEqual(len(first), 10)
+                self.assertFalse(first.has_previous())
+                older = self.client.get(
+                    url, {'cursor': first.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(len(older), 3)
+                self.assertFalse(older.has_next())
+                self.assertEqual(
+                    [post.pk for post in first] + [post.pk for post in older],
+                    list(Post.objects.values_list('pk', flat=True)),
+                )
+                newer = self.client.get(
+                    url, {'cursor': older.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in newer], [post.pk for post in first]
+                )
+                self.assertFalse(newer.has_previous())
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='author', first_name='Лев', last_name='Толстой'
+        )
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Тестовый пост'
+        )
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def add_posts(self):
+        start = User.objects.count()
+        for i in range(start, start + COUNT_PAGE):
+            author = User.objects.create_user(
+                username=f'writer_{i}', first_name='Имя', last_name=str(i)
+            )
+            Follow.objects.create(user=self.reader, author=author)
+            group = Group.objects.create(
+                title=f'Группа {i}', slug=f'group_{i}', description='-'
+            )
+            Post.objects.create(author=author, group=group, text='Пост')
+            Post.objects.create(
+                author=self.author, group=group, text='Пост'
+            )
+
+    def add_comments(self):
+        start = User.objects.count()
+        for i in range(start, start + COUNT_PAGE):
+            author = User.objects.create_user(username=f'commenter_{i}')
+            Comment.objects.create(post=self.post, author=author, text='-')
+
+    def test_feed_query_budget(self):
+        """Ленты делают постоянное число запросов."""
+        urls = {
+            reverse('posts:index'): 4,
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}): 5,
+            reverse('posts:profile', kwargs={'username': 'author'}): 6,
+            reverse('posts:follow_index'): 6,
+        }
+        for url, budget in urls.items():
+            with self.subTest(url=url):
+                self.assertQueryBudget(
+                    self.reader_client, url, budget, self.add_posts
+                )
+
+    def test_post_detail_query_budget(self):
+        """Страница поста не делает запросов на каждый комментарий."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.assertQueryBudget(self.reader_client, url, 4, self.add_comments)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN из SQLite')
+class FeedIndexesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Тестовый пост'
+        )
+        Comment.objects.create(post=cls.post, author=cls.reader, text='-')
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def feed_query_plans(self, url):
+        """Планы SQLite для упорядоченных выборок постов и комментариев."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.reader_client.get(url)
+        plans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if ('ORDER BY' in sql
+                    and ('FROM "posts_post"' in sql
+                         or 'FROM "posts_comment"' in sql)):
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plans.append(' | '.join(row[-1] for row in cursor))
+        return plans
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты читаются по индексу, без сортировки во временном B-tree."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:follow_index'),
+            reverse('posts:follow_index') + '?cursor='
+            + encode_cursor(self.post, NEWER),
+            reverse('posts:api_follow') + '?cursor='
+            + encode_cursor(self.post, OLDER),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        for url in urls:
+            plans = self.feed_query_plans(url)
+            self.assertTrue(plans, f'{url}: нет выборки ленты')
+            for plan in plans:
+                with self.subTest(url=url, plan=plan):
+                    self.assertIn('INDEX', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_celebrity_follow_feed_uses_indexes(self):
+        """Лента с популярным автором тоже читается по индексам."""
+        UserStats.objects.filter(user=self.author).update(
+            followers_count=FANOUT_FOLLOWERS_LIMIT + 1, celebrity=True
+        )
+        url = reverse('posts:follow_index')
+        for params in ('', '?page=2', '?cursor='):
+            plans = self.feed_query_plans(url + params)
+            self.assertTrue(plans, f'{params}: нет выборки ленты')
+            for plan in plans:
+                with self.subTest(params=params, plan=plan):
+                    self.assertIn('INDEX', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+
+class PostCardsCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Тестовый пост'
+        )
+
+    def test_feeds_share_cached_cards(self):
+        """Карточка рендерится один раз для всех лент до правки поста."""
+        cache.clear()
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+        ]
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string',
+            wraps=post_cards.render_to_string,
+        ) as render_card:
+            self.client.get(urls[0])
+            rendered = render_card.call_count
+            self.client.get(urls[1])
+            self.assertEqual(render_card.call_count, rendered)
+            Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+            new_post = Post.objects.create(author=self.author, text='Новый')
+            response = self.client.get(urls[0])
+            self.assertEqual(render_card.call_count, rendered + 1)
+        self.assertContains(response, 'Тестовый пост')
+        self.assertContains(response, new_post.text)
+        self.post.text = 'Правка через форму'
+        self.post.save()
+        self.assertContains(self.client.get(urls[0]), 'Правка через форму')
+
+    def test_full_text_outside_follow_feed(self):
+        """Главная, группа и профиль показывают текст целиком,
+        лента подписок - сокращенным."""
+        text = ' '.join(f'слово{number}' for number in range(40))
+        Post.objects.create(author=self.author, group=self.group, text=text)
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=['test_slug']),
+            reverse('posts:profile', args=['author']),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'слово39')
+        reader = User.objects.create_user(username='card_reader')
+        Follow.objects.create(user=reader, author=self.author)
+        self.client.force_login(reader)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'слово29 …')
+        self.assertNotContains(response, 'слово39')
+
+    def cached_pages(self, urls):
+        """Кеширует страницы для гостя и вошедшего, возвращает функцию,
+        которая запрашивает их снова: пары (адрес, ответ)."""
+        reader = Client()
+        reader.force_login(User.objects.create_user(username='card_fan'))
+        clients = [self.client, reader]
+        for url in urls:
+            for client in clients:
+                client.get(url)
+        return lambda: [
+            (url, client.get(url)) for url in urls for client in clients
+        ]
+
+    def test_cards_follow_author_changes(self):
+        """Правка автора видна в кешированных лентах и старом профиле."""
+        cache.clear()
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=['test_slug']),
+            reverse('posts:profile', args=['author']),
+        ]
+        get_pages = self.cached_pages(urls)
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Новое'
+        author.username = 'renamed'
+        author.save()
+        profile = reverse('posts:profile', args=['renamed'])
+        for url, response in get_pages():
+            with self.subTest(url=url):
+                if url == urls[2]:
+                    self.assertEqual(response.status_code, 404)
+                else:
+                    self.assertContains(response, 'Новое')
+                    self.assertContains(response, profile)
+
+    def test_cards_follow_group_changes(self):
+        """Смена слага видна в лентах, старый адрес группы - 404."""
+        cache.clear()
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', args=['author']),
+            reverse('posts:group_list', args=['test_slug']),
+        ]
+        get_pages = self.cached_pages(urls)
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'new_slug'
+        group.save()
+        new_url = reverse('posts:group_list', args=['new_slug'])
+        for url, response in get_pages():
+            with self.subTest(url=url):
+                if url == urls[2]:
+                    self.assertEqual(response.status_code, 404)
+                else:
+                    self.assertContains(response, new_url)
+                    self.assertNotContains(response, urls[2])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='searcher')
+
+    def search(self, query, page=1):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, 'page': page}
+        )
+
+    def test_ranked_results_with_snippets(self):
+        """Поиск находит посты по префиксу, ранжирует и подсвечивает."""
+        rare = Post.objects.create(
+            author=self.author, text='Длинный пост про разное, и один котик'
+        )
+        often = Post.objects.create(
+            author=self.author, text='Котики, котики <b>и</b> котики'
+        )
+        Post.objects.create(author=self.author, text='Про собак')
+        response = self.search('кот')
+        posts = list(response.context['page_obj'])
+        self.assertEqual(posts, [often, rare])
+        self.assertIn('<mark>котик</mark>', posts[1].snippet)
+        self.assertIn('&lt;b&gt;', posts[0].snippet)
+
+    def test_index_follows_post_changes(self):
+        """Индекс обновляется при правке и удалении поста."""
+        post = Post.objects.create(author=self.author, text='Старый текст')
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(len(self.search('старый').context['page_obj']), 0)
+        self.assertEqual(len(self.search('новый').context['page_obj']), 1)
+        post.delete()
+        self.assertEqual(len(self.search('новый').context['page_obj']), 0)
+
+    def test_pagination_keeps_query(self):
+        """Ссылки пагинатора сохраняют поисковый запрос."""
+        for number in range(COUNT_PAGE + 1):
+            Post.objects.create(author=self.author, text=f'Заметка {number}')
+        response = self.search('заметка')
+        self.assertEqual(response.context['page_obj'].paginator.count,
+                         COUNT_PAGE + 1)
+        self.assertContains(response, '?q=%D0%B7%D0%B0%D0%BC%D0%B5%D1%82'
+                                      '%D0%BA%D0%B0&amp;page=2')
+        self.assertEqual(len(self.search('заметка', 2).context['page_obj']),
+                         1)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='leo', first_name='Лев', last_name='Толстой'
+        )
+        cls.group = Group.objects.create(
+            title='Литература', slug='lit', description='Книги'
+        )
+
+    def setUp(self):
+        # Индекс процесса помнит записи из откаченных транзакций.
+        autocomplete.index._keys = None
+        self.user = User.objects.get(pk=self.user.pk)
+        self.group = Group.objects.get(slug='lit')
+
+    def lookup(self, query):
+        response = self.client.get(reverse('posts:autocomplete'), {'q': query})
+        return [item['url'] for item in response.json()['results']]
+
+    def test_prefix_lookup(self):
+        """Автодополнение ищет по началу логина, имени, группы и слага."""
+        profile = reverse('posts:profile', args=['leo'])
+        group = reverse('posts:group_list', args=['lit'])
+        cases = {
+            'le': [profile], 'ЛЕВ Т': [profile], 'толс': [profile],
+            'ли': [group], 'l': [profile, group], 'x': [], '': [],
+        }
+        for query, urls in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(self.lookup(query), urls)
+        with self.assertNumQueries(0):
+            autocomplete.index.search('ле')
+
+    def test_incremental_refresh(self):
+        """Индекс обновляется при правке и удалении без перечитывания."""
+        self.lookup('l')
+        self.user.username = 'tolstoy'
+        self.user.save()
+        self.group.delete()
+        with self.assertNumQueries(0):
+            found = autocomplete.index.search('l')
+        self.assertEqual(found, [])
+        self.assertEqual(
+            autocomplete.index.search('tol'),
+            [(autocomplete.USER, 'Лев Толстой (@tolstoy)', 'tolstoy')],
+        )
+
+    def test_changes_from_other_process(self):
+        """Другой процесс применяет изменения из кеша, не читая базу."""
+        other = autocomplete.PrefixIndex()
+        other.search('l')
+        self.user.username = 'tolstoy'
+        self.user.save()
+        self.group.delete()
+        other._checked = 0
+        with self.assertNumQueries(0):
+            found = other.search('l')
+        self.assertEqual(found, [])
+        self.assertEqual(
+            [arg for _, _, arg in other.search('tol')], ['tolstoy']
+        )
+
+    @mock.patch('posts.autocomplete.LOCAL_RELOAD_INTERVAL', 0)
+    def test_local_cache_reloads_index(self):
+        """Без общего кеша индекс перечитывается по интервалу."""
+        other = autocomplete.PrefixIndex()
+        other.search('l')
+        # Правка в обход сигналов, как из процесса со своим кешем.
+        Group.objects.filter(pk=self.group.pk).update(title='Поэзия')
+        other._checked = 0
+        self.assertEqual(
+            [arg for _, _, arg in other.search('поэ')], ['lit']
+        )
+
+    def test_lost_changes_reload_index(self):
+        """Если изменения вытеснены из кеша, индекс перечитывает базу."""
+        other = autocomplete.PrefixIndex()
+        other.search('l')
+        self.group.delete()
+        cache.delete(autocomplete.CHANGE_KEY.format(
+            cache.get(autocomplete.VERSION_KEY)
+        ))
+        other._checked = 0
+        with self.assertNumQueries(2):
+            self.assertEqual(other.search('ли'), [])
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='apiauthor')
+        cls.reader = User.objects.create_user(username='apireader')
+        cls.group = Group.objects.create(
+            title='API', slug='api', description='Описание'
+        )
+        for number in range(COUNT_PAGE + 2):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {number}'
+            )
+        cls.post = Post.objects.latest('pk')
+        for number in range(COUNT_PAGE + 1):
+            Comment.objects.create(
+                post=cls.post, author=cls.reader, text=f'Комментарий {number}'
+            )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feeds_page_with_cursor(self):
+        """Ленты API листаются курсором без пропусков и повторов."""
+        urls = [
+            reverse('posts:api_index'),
+            reverse('posts:api_group', args=['api']),
+            reverse('posts:api_profile', args=['apiauthor']),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.client.get(url).json()
+                self.assertEqual(len(first['results']), COUNT_PAGE)
+                self.assertIsNone(first['previous'])
+                second = self.client.get(
+                    url, {'cursor': first['next']}
+                ).json()
+                self.assertIsNone(second['next'])
+                texts = [post['text'] for post in
+                         first['results'] + second['results']]
+                self.assertEqual(
+                    texts, [f'Пост {number}'
+                            for number in range(COUNT_PAGE + 1, -1, -1)]
+                )
+                back = self.client.get(
+                    url, {'cursor': second['previous']}
+                ).json()
+                self.assertEqual(back['results'], first['results'])
+
+    def test_sparse_fields(self):
+        """?fields= оставляет только запрошенные поля."""
+        response = self.client.get(
+            reverse('posts:api_post', args=[self.post.pk]),
+            {'fields': 'text,id'},
+        )
+        self.assertEqual(
+            response.json(), {'id': self.post.pk, 'text': self.post.text}
+        )
+        response = self.client.get(
+            reverse('posts:api_index'), {'fields': 'id,password'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+
+    def test_feed_objects(self):
+        """Лента группы и профиля содержит описание группы и автора."""
+        group = self.client.get(reverse('posts:api_group', args=['api']))
+        self.assertEqual(group.json()['group']['title'], 'API')
+        profile = self.client.get(
+            reverse('posts:api_profile', args=['apiauthor'])
+        ).json()
+        self.assertEqual(
+            profile['author']['posts_count'], COUNT_PAGE + 2
+        )
+        self.assertEqual(
+            self.client.get(
+                reverse('posts:api_group', args=['missing'])
+            ).status_code,
+            404,
+        )
+
+    def test_comments_oldest_first(self):
+        """Комментарии идут от старых к новым и листаются курсором."""
+        url = reverse('posts:api_comments', args=[self.post.pk])
+        first = self.client.get(url, {'fields': 'text'}).json()
+        second = self.client.get(
+            url, {'fields': 'text', 'cursor': first['next']}
+        ).json()
+        self.assertEqual(
+            [comment['text'] for comment in
+             first['results'] + second['results']],
+            [f'Комментарий {number}' for number in range(COUNT_PAGE + 1)],
+        )
+        self.assertIsNone(second['next'])
+
+    def test_follow_needs_login(self):
+        """Лента подписок в API только для вошедших."""
+        url = reverse('posts:api_follow')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(self.reader)
+        self.assertEqual(
+            len(self.client.get(url).json()['results']), COUNT_PAGE
+        )
+
+    def test_cached_lists_follow_comments_and_renames(self):
+        """Кешированный список видит новый комментарий и новый логин."""
+        url = reverse('posts:api_index')
+        response = self.client.get(url)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Свежий'
+        )
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(
+            changed.json()['results'][0]['comments_count'], COUNT_PAGE + 2
+        )
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'apirenamed'
+        author.save()
+        self.assertEqual(
+            self.client.get(url).json()['results'][0]['author'], 'apirenamed'
+        )
+
+    def test_long_path_fits_cache_key(self):
+        """Длинный адрес запроса не делает ключ кеша длиннее допустимого."""
+        url = reverse('posts:api_index')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get(url, {'pad': 'x' * 300})
+        self.assertEqual(response.status_code, 200)
+
+    def test_responses_cached_until_feed_changes(self):
+        """Повтор берется из кеша, а после нового поста ответ другой."""
+        url = reverse('posts:api_group', args=['api'])
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, response.content)
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        Post.objects.create(
+            author=self.author, group=self.group, text='Новый пост'
+        )
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.json()['results'][0]['text'], 'Новый пост')
+
+
+class NewPostsPollTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='poller')
+        cls.reader = User.objects.create_user(username='pollreader')
+        cls.group = Group.objects.create(
+            title='Опрос', slug='poll', description='Описание'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        Post.objects.create(
+            author=cls.author, group=cls.group, text='Старый пост'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def poll_cursor(self, name, *args):
+        return self.client.get(
+            reverse(f'posts:api_{name}', args=args)
+        ).json()['poll']
+
+    def test_new_posts_counted_per_feed(self):
+        """Опрос возвращает число и id постов новее курсора."""
+        feeds = [
+            ('index', []), ('group', ['poll']),
+            ('profile', ['poller']), ('follow', []),
+        ]
+        cursors = {name: self.poll_cursor(name, *args)
+                   for name, args in feeds}
+        new_post = Post.objects.create(
+            author=self.author, group=self.group, text='Новый пост'
+        )
+        for name, args in feeds:
+            with self.subTest(feed=name):
+                response = self.client.get(
+                    reverse(f'posts:api_{name}_new', args=args),
+                    {'cursor': cursors[name]},
+                )
+                self.assertEqual(
+                    response.json(), {'count': 1, 'ids': [new_post.pk]}
+                )
+
+    def test_unchanged_poll_skips_database(self):
+        """Без новых постов повторный опрос не читает базу."""
+        self.client.logout()
+        url = reverse('posts:api_group_new', args=['poll'])
+        cursor = self.poll_cursor('group', 'poll')
+        self.client.get(url, {'cursor': cursor})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_unchanged_follow_poll_skips_posts(self):
+        """Опрос ленты подписок читает из базы только сессию."""
+        url = reverse('posts:api_follow_new')
+        cursor = self.poll_cursor('follow')
+        self.client.get(url, {'cursor': cursor})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual(response.json()['count'], 0)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('posts_', tables)
+
+    def test_poll_needs_cursor(self):
+        """Опрос без курсора или с битым курсором - ошибка 400."""
+        url = reverse('posts:api_index_new')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'cursor': 'broken'}).status_code, 400
+        )
+        naive = base64.urlsafe_b64encode(
+            f'{NEWER}|2020-01-01T00:00:00|5'.encode()
+        ).decode()
+        self.assertEqual(
+            self.client.get(url, {'cursor': naive}).status_code, 400
+        )
+
+
+class CommentPagesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='discussed')
+        cls.post = Post.objects.create(author=cls.author, text='Обсуждаемый')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.author, text=f'Реплика №{i}.')
+            for i in range(COMMENTS_PAGE + 5)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_detail_shows_first_page(self):
+        """На странице поста первая страница комментариев и ссылка дальше."""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk])
+        )
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_PAGE)
+        self.assertEqual(comments[0].text, 'Реплика №0.')
+        self.assertContains(response, 'Реплика №0.')
+        self.assertNotContains(response, f'Реплика №{COMMENTS_PAGE}.')
+        self.assertContains(
+            response,
+            f'{reverse("posts:comments", args=[self.post.pk])}'
+            f'?cursor={comments.next_cursor}',
+        )
+        self.assertContains(
+            response, comments[0].created.strftime('%d-%m-%Y %H:%M')
+        )
+
+    def test_fragment_loads_rest(self):
+        """Фрагмент отдает следующие комментарии без ссылки дальше."""
+        first = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk])
+        ).context['comments']
+        response = self.client.get(
+            reverse('posts:comments', args=[self.post.pk]),
+            {'cursor': first.next_cursor},
+        )
+        self.assertTemplateUsed(response, 'includes/comments.html')
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            [f'Реплика №{i}.'
+             for i in range(COMMENTS_PAGE, COMMENTS_PAGE + 5)],
+        )
+        self.assertNotContains(response, 'Показать еще')
+        self.assertEqual(
+            self.client.get(
+                reverse('posts:comments', args=[self.post.pk + 1])
+            ).status_code,
+            404,
+        )
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='exporter')
+        cls.group = Group.objects.create(
+            title='Выгрузка', slug='export', description='Описание'
+        )
+        for number in range(3):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост, {number}'
+            )
+        Post.objects.create(author=cls.author, text='Без группы')
+
+    def setUp(self):
+        self.client.force_login(self.author)
+
+    def export(self, name, arg, data_format):
+        response = self.client.get(
+            reverse(f'posts:{name}_export', args=[arg]),
+            {'format': data_format},
+        )
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_profile_jsonl(self):
+        """Выгрузка профиля в JSONL содержит все посты автора."""
+        rows = [
+            json.loads(line)
+            for line in self.export('profile', 'exporter', 'jsonl').split('\n')
+            if line
+        ]
+        self.assertEqual(
+            [row['text'] for row in rows],
+            ['Без группы', 'Пост, 2', 'Пост, 1', 'Пост, 0'],
+        )
+        self.assertEqual(rows[1]['author'], 'exporter')
+        self.assertEqual(rows[1]['group'], 'export')
+
+    def test_group_csv(self):
+        """Выгрузка группы в CSV читается обратно."""
+        rows = list(csv.DictReader(
+            StringIO(self.export('group', 'export', 'csv'))
+        ))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['text'], 'Пост, 2')
+
+    def test_unknown_format(self):
+        """Неизвестный формат выгрузки - 404."""
+        response = self.client.get(
+            reverse('posts:group_export', args=['export']), {'format': 'xml'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SyndicationFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='feeder')
+        cls.group = Group.objects.create(
+            title='Ленты', slug='feeds', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост для ленты'
+        )
+
+    def test_feeds_render_posts(self):
+        """RSS и Atom ленты главной, группы и профиля содержат посты."""
+        urls = [
+            reverse('posts:index_rss'),
+            reverse('posts:index_atom'),
+            reverse('posts:group_rss', args=['feeds']),
+            reverse('posts:group_atom', args=['feeds']),
+            reverse('posts:profile_rss', args=['feeder']),
+            reverse('posts:profile_atom', args=['feeder']),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, 'Пост для ленты')
+                self.assertTrue(response.has_header('ETag'))
+                self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(
+            self.client.get(
+                reverse('posts:group_rss', args=['missing'])
+            ).status_code,
+            404,
+        )
+
+    def test_unchanged_poll_gets_304(self):
+        """Повторный опрос без изменений получает 304 без запросов к базе."""
+        url = reverse('posts:group_rss', args=['feeds'])
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'],
+                HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+            )
+        self.assertEqual(cached.status_code, 304)
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(changed, 'Исправленный пост')
+
+    def test_if_modified_since_sees_edit_and_delete(self):
+        """Читалка только с If-Modified-Since видит правку и удаление."""
+        url = reverse('posts:profile_atom', args=['feeder'])
+        newest = Post.objects.create(author=self.author, text='Свежий')
+        for change in (self.post.save, newest.delete):
+            stamp = self.client.get(url)['Last-Modified']
+            change()
+            with self.subTest(change=change):
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=stamp)
+                self.assertEqual(response.status_code, 200)
+
+
+class ConditionalPageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='stamped')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Метки', slug='stamps', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост с меткой'
+        )
+
+    def test_unchanged_pages_get_304(self):
+        """Повторный запрос неизменившейся страницы получает 304."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:profile', args=['stamped']),
+            reverse('posts:group_list', args=['stamps']),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('Last-Modified'))
+                with self.assertNumQueries(0):
+                    cached = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(cached.status_code, 304)
+
+    def test_guests_revalidate_cached_pages(self):
+        """Страница из кеша сервера не хранится у клиента без проверки."""
+        url = reverse('posts:index')
+        for response in (self.client.get(url), self.client.get(url)):
+            self.assertFalse(response.has_header('Expires'))
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertIn('max-age=0', response['Cache-Control'])
+            self.assertTrue(response.has_header('ETag'))
+
+    def test_new_comment_changes_post_page(self):
+        """После комментария страница поста отдается заново."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        response = self.client.get(url)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Свежий комментарий'
+        )
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(changed, 'Свежий комментарий')
+
+    def test_post_page_follows_author_and_group(self):
+        """Сайдбар поста у гостя меняется вслед за автором и группой."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        response = self.client.get(url)
+        Post.objects.create(author=self.author, text='Еще пост')
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(changed, 'Всего постов автора:  <span >2</span>')
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name, author.last_name = 'Новое', 'Имя'
+        author.save()
+        self.assertContains(self.client.get(url), 'Автор: Новое Имя')
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новые метки'
+        group.save()
+        self.assertContains(self.client.get(url), 'Группа: Новые метки')
+
+    def test_last_modified_moves_on_edit_and_delete(self):
+        """Клиент только с If-Modified-Since видит правку и удаление."""
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Последний пост'
+        )
+        urls = [
+            reverse('posts:profile', args=['stamped']),
+            reverse('posts:group_list', args=['stamps']),
+        ]
+        for change in (self.post.save, post.delete):
+            stamps = {url: self.client.get(url)['Last-Modified']
+                      for url in urls}
+            change()
+            for url in urls:
+                with self.subTest(url=url, change=change):
+                    response = self.client.get(
+                        url, HTTP_IF_MODIFIED_SINCE=stamps[url]
+                    )
+                    self.assertEqual(response.status_code, 200)
+
+    def test_login_keeps_profile_etag(self):
+        """Вход автора не сбрасывает кеш и ETag его профиля."""
+        url = reverse('posts:profile', args=['stamped'])
+        etag = self.client.get(url)['ETag']
+        Client().force_login(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_differs_per_user(self):
+        """Гость и пользователь не получают ETag друг друга."""
+        url = reverse('posts:profile', args=['stamped'])
+        guest_etag = self.client.get(url)['ETag']
+        client = Client()
+        client.force_login(self.reader)
+        response = client.get(url, HTTP_IF_NONE_MATCH=guest_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], guest_etag)
@@ -0,0 +1,27 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Проверки числа SQL-запросов, которые делает страница без кеша."""
+
+    def count_queries(self, client, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueryBudget(self, client, url, budget, grow):
+        """Число запросов не выше budget и не растет после grow()."""
+        before = self.count_queries(client, url)
+        grow()
+        after = self.count_queries(client, url)
+        self.assertLessEqual(
+            after, budget, f'{url}: {after} запросов при бюджете {budget}'
+        )
+        self.assertEqual(
+            before, after,
+            f'{url}: число запросов растет вместе с данными'
+        )
@@ -0,0 +1,292 @@
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+from django.db.models import F, Q
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .ulits import invalidate_feed_counts
+
+# Авторам с большим числом подписчиков ленту не раскладываем,
+# их посты подмешиваются в ленту при чтении.
+FANOUT_FOLLOWERS_LIMIT: int = 1000
+# Обратно в раскладку автор попадает только ниже этой границы: счетчик,
+# который колеблется около лимита, не гоняет раскладку туда-обратно.
+FANOUT_FOLLOWERS_RESUME: int = 900
+# Сколько новейших постов бывшей знаменитости раскладывается в ленты.
+FANOUT_RESUME_POSTS: int = 50
+FANOUT_BATCH_SIZE: int = 500
+# Поля поста -> поля копии в ленте, по которым она идет по индексу.
+TIMELINE_FIELDS = {
+    'pub_date': 'timeline_entries__pub_date',
+    'pk': 'timeline_entries__post',
+}
+
+
+def celebrities(author_ids):
+    """Отбирает авторов, чьи посты читаются в обход материализованных лент."""
+    return set(
+        UserStats.objects.filter(
+            user_id__in=author_ids, celebrity=True,
+        ).values_list('user_id', flat=True)
+    )
+
+
+def is_celebrity(author_id):
+    return bool(celebrities([author_id]))
+
+
+def _batches(iterable):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, FANOUT_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _bulk_insert(entries):
+    for batch in _batches(entries):
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    for user_ids in _batches(followers.iterator()):
+        _bulk_insert(
+            TimelineEntry(user_id=user_id, post_id=post.pk,
+                          pub_date=post.pub_date)
+            for user_id in user_ids
+        )
+        invalidate_feed_counts(*(f'follow:{user_id}' for user_id in user_ids))
+
+
+def fan_out_posts(posts):
+    """Раскладывает пачку постов, созданных в обход сигналов.
+
+    posts - кортежи (id, id автора, дата публикации).
+    """
+    by_author = defaultdict(list)
+    for pk, author_id, pub_date in posts:
+        by_author[author_id].append((pk, pub_date))
+    for author_id in celebrities(list(by_author)):
+        del by_author[author_id]
+    followers = set()
+    follows = Follow.objects.filter(
+        author_id__in=list(by_author)
+    ).values_list('user_id', 'author_id')
+    for batch in _batches(follows.iterator()):
+        _bulk_insert(
+            TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for user_id, author_id in batch
+            for pk, pub_date in by_author[author_id]
+        )
+        followers.update(user_id for user_id, _ in batch)
+    invalidate_feed_counts(*(f'follow:{user_id}' for user_id in followers))
+
+
+def backfill(user_id, author_id):
+    """Переносит посты автора в ленту нового подписчика."""
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', 'pub_date')
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts.iterator()
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def promote(author_id):
+    """Отмечает знаменитостью автора с подписчиками сверх лимита."""
+    UserStats.objects.filter(
+        user_id=author_id, celebrity=False,
+        followers_count__gt=FANOUT_FOLLOWERS_LIMIT,
+    ).update(celebrity=True)
+
+
+def demote(author_id):
+    """Снимает отметку, когда подписчиков не больше FANOUT_FOLLOWERS_RESUME.
+
+    Возвращает True только тому вызову, который снял отметку.
+    """
+    return bool(UserStats.objects.filter(
+        user_id=author_id, celebrity=True,
+        followers_count__lte=FANOUT_FOLLOWERS_RESUME,
+    ).update(celebrity=False))
+
+
+def fan_out_former_celebrity(author_id):
+    """Раскладывает подписчикам новейшие посты бывшей знаменитости.
+
+    Пока автор был знаменитостью, его посты подмешивались при чтении и
+    в ленты не попадали. Берется не больше FANOUT_RESUME_POSTS постов:
+    более старые остаются в профиле автора.
+    """
+    posts = list(
+        Post.objects.filter(author_id=author_id).values_list(
+            'pk', 'pub_date'
+        )[:FANOUT_RESUME_POSTS]
+    )
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    for user_ids in _batches(followers.iterator()):
+        _bulk_insert(
+            TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for user_id in user_ids
+            for pk, pub_date in posts
+        )
+        invalidate_feed_counts(*(f'follow:{user_id}' for user_id in user_ids))
+
+
+def _aliased(lookup, fields):
+    name, sep, rest = lookup.partition('__')
+    return fields.get(name, name) + sep + rest
+
+
+def _aliased_q(condition, fields):
+    """Копия Q с полями поста, замененными по fields."""
+    aliased = Q()
+    aliased.connector, aliased.negated = condition.connector, condition.negated
+    aliased.children = [
+        _aliased_q(child, fields) if isinstance(child, Q)
+        else (_aliased(child[0], fields), child[1])
+        for child in condition.children
+    ]
+    return aliased
+
+
+class MergedPosts:
+    """Посты из нескольких выборок, каждая читается по своему индексу.
+
+    Срез берет из каждой выборки не больше записей, чем нужно до его
+    конца, и сливает их по ключу сортировки, так что общей сортировки
+    во временном B-tree нет. Пост из нескольких выборок попадает в
+    результат один раз. Поддерживает то, что нужно пагинаторам и API:
+    filter, order_by, values_list, count, first и срезы.
+
+    parts - тройки (выборка, ее условие, замены полей поста для нее),
+    counted - выборка тех же постов без порядка для count(). Условия
+    filter() переводятся заменами и ставятся в один filter() с условием
+    выборки: так они ложатся на тот же JOIN и тот же индекс.
+    """
+    ordered = True
+
+    def __init__(self, parts, counted, ordering=('-pub_date', '-pk'),
+                 where=Q(), fields=None, flat=False):
+        self.parts = parts
+        self.counted = counted
+        self.ordering = ordering
+        self.where = where
+        self.fields = fields
+        self.flat = flat
+
+    def _clone(self, **changes):
+        params = {
+            'parts': self.parts, 'counted': self.counted,
+            'ordering': self.ordering, 'where': self.where,
+            'fields': self.fields, 'flat': self.flat,
+        }
+        params.update(changes)
+        return MergedPosts(**params)
+
+    def filter(self, *args, **kwargs):
+        return self._clone(
+            where=self.where & Q(*args, **kwargs),
+            counted=self.counted.filter(*args, **kwargs),
+        )
+
+    def order_by(self, *ordering):
+        return self._clone(ordering=ordering)
+
+    def values_list(self, *fields, flat=False):
+        return self._clone(fields=fields, flat=flat)
+
+    def count(self):
+        return self.counted.count()
+
+    def first(self):
+        found = self[:1]
+        return found[0] if found else None
+
+    def _rows(self, part, index):
+        """Записи выборки в срезе index: (ключ сортировки, запись)."""
+        posts, condition, fields = part
+        names = [field.lstrip('-') for field in self.ordering]
+        # Через F: строка с внешним ключом сортировала бы по порядку Post.
+        posts = posts.filter(
+            condition & _aliased_q(self.where, fields)
+        ).order_by(*(
+            F(fields.get(name, name)).desc() if field.startswith('-')
+            else F(fields.get(name, name)).asc()
+            for field, name in zip(self.ordering, names)
+        ))
+        if self.fields is None:
+            return [
+                (tuple(getattr(post, name) for name in names), post)
+                for post in posts[index]
+            ]
+        rows = posts.values_list(*names, *self.fields)[index]
+        return [
+            (row[:len(names)], row[len(names)] if self.flat
+             else row[len(names):])
+            for row in rows
+        ]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if len(self.parts) == 1:
+            # Одна выборка: срез целиком уходит в LIMIT и OFFSET.
+            return [record for _, record in self._rows(self.parts[0], index)]
+        merged = heapq.merge(
+            *(self._rows(part, slice(index.stop)) for part in self.parts),
+            key=lambda row: row[0],
+            reverse=self.ordering[0].startswith('-'),
+        )
+        found, last = [], None
+        for key, record in merged:
+            if key != last:
+                found.append(record)
+                last = key
+        return found[index]
+
+
+def get_timeline_posts(user):
+    """Посты ленты подписок: разложенные записи плюс посты знаменитостей.
+
+    Разложенная лента читается по копиям даты и id в TimelineEntry,
+    посты знаменитостей - по индексу автора, и все сливается через
+    MergedPosts.
+    """
+    read_authors = celebrities(
+        Follow.objects.filter(user=user).values_list('author_id', flat=True)
+    )
+    posts = Post.objects.select_related('author', 'group')
+    timeline = (posts, Q(timeline_entries__user=user), TIMELINE_FIELDS)
+    if not read_authors:
+        return MergedPosts(
+            [timeline], Post.objects.filter(timeline_entries__user=user)
+        )
+    entries = TimelineEntry.objects.filter(user=user).values('post_id')
+    return MergedPosts(
+        [timeline] + [
+            (posts, Q(author_id=author_id), {})
+            for author_id in sorted(read_authors)
+        ],
+        posts.filter(Q(pk__in=entries) | Q(author_id__in=read_authors)),
+    )
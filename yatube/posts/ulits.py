@@ -1,10 +1,410 @@
+import base64
+import binascii
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control
+from django.utils.functional import cached_property
+from django.utils.timezone import is_naive
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+# Без общего кеша сброс версии виден только своему процессу,
+# остальные узнают об изменении, когда истечет срок.
+LOCAL_CACHE_TIMEOUT: int = 20
+
+
+def cache_timeout(timeout):
+    """Срок хранения с учетом того, общий ли кеш у процессов."""
+    if settings.SHARED_CACHE:
+        return timeout
+    return min(timeout, LOCAL_CACHE_TIMEOUT)
+
 
 COUNT_PAGE: int = 10
+COMMENTS_PAGE: int = 20
+COUNT_CACHE_TIMEOUT: int = cache_timeout(60 * 5)
+# Посты знаменитостей не сбрасывают ленты подписчиков, отсюда срок.
+LATEST_CACHE_TIMEOUT: int = cache_timeout(60)
+FEED_CACHE_TIMEOUT: int = cache_timeout(60 * 60)
+# Версии заводятся и для имен из URL, которых нет в базе, поэтому живут
+# не вечно. Пропавшая версия начнется заново с текущего времени.
+FEED_VERSION_TIMEOUT: int = cache_timeout(60 * 60 * 24)
+PAGES_ON_EACH_SIDE: int = 2
+PAGES_ON_ENDS: int = 1
+CURSOR_PARAM: str = 'cursor'
+OLDER: str = 'o'
+NEWER: str = 'n'
+
+
+def encode_cursor(obj, direction, field='pub_date'):
+    """Непрозрачный курсор на позицию записи в ленте."""
+    raw = f'{direction}|{getattr(obj, field).isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Возвращает (направление, дата, id) или None для битого курсора."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if direction not in (OLDER, NEWER) or pub_date is None:
+        return None
+    # Наивную дату не сравнить с датами из базы, а курсоры мы выдаем
+    # только с часовым поясом.
+    if settings.USE_TZ and is_naive(pub_date):
+        return None
+    return direction, pub_date, pk
+
+
+class CursorPage:
+    """Страница ленты по ключу (pub_date, id): без COUNT и OFFSET."""
+    cursor_mode = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def get_cursor_page(object_list, cursor=None, per_page=COUNT_PAGE,
+                    field='pub_date', descending=True):
+    """Страница по ключу (field, id). OLDER листает дальше по порядку
+    ленты, NEWER - назад; для ленты по убыванию это старее и новее."""
+    position = decode_cursor(cursor) if cursor else None
+    direction = position[0] if position else OLDER
+    # Идем ли по убыванию ключа: вперед по ленте-по-убыванию
+    # или назад по ленте-по-возрастанию.
+    if (direction == OLDER) == descending:
+        sign, lookup = '-', 'lt'
+    else:
+        sign, lookup = '', 'gt'
+    records = object_list.order_by(f'{sign}{field}', f'{sign}pk')
+    if position is not None:
+        _, value, pk = position
+        records = records.filter(
+            Q(**{f'{field}__{lookup}': value})
+            | Q(**{field: value, f'pk__{lookup}': pk})
+        )
+    # Лишняя запись показывает, есть ли что-то за краем страницы.
+    records = list(records[:per_page + 1])
+    has_more = len(records) > per_page
+    records = records[:per_page]
+    if direction == NEWER:
+        records.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = position is not None, has_more
+    if not records:
+        return CursorPage(records)
+    return CursorPage(
+        records,
+        next_cursor=encode_cursor(records[-1], OLDER, field)
+        if has_older else None,
+        previous_cursor=encode_cursor(records[0], NEWER, field)
+        if has_newer else None,
+    )
+
+
+def feed_count_key(feed):
+    return f'feed_count:{feed}'
+
+
+def feed_latest_key(feed):
+    return f'feed_latest:{feed}'
+
+
+def invalidate_feed_counts(*feeds):
+    """Сбрасывает число записей и новейший пост лент feeds."""
+    cache.delete_many(
+        [feed_count_key(feed) for feed in feeds]
+        + [feed_latest_key(feed) for feed in feeds]
+    )
+
+
+def feed_latest(feed, get_posts):
+    """(pub_date, id) новейшего поста ленты или None, если она пуста.
+
+    Хранится в кеше до сброса через invalidate_feed_counts. get_posts
+    строит выборку постов ленты и вызывается только при промахе.
+    """
+    key = feed_latest_key(feed)
+    latest = cache.get(key)
+    if latest is None:
+        latest = get_posts().order_by('-pub_date', '-pk').values_list(
+            'pub_date', 'pk'
+        ).first() or ()
+        cache.set(key, latest, LATEST_CACHE_TIMEOUT)
+    return latest or None
+
+
+def feed_version_key(feed):
+    return f'feed_version:{feed}'
+
+
+def _new_version():
+    # Версия от времени: пропавший из кеша ключ не вернет старые страницы.
+    return int(time.time() * 1000)
+
+
+def feed_version(feed):
+    key = feed_version_key(feed)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, FEED_VERSION_TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def feed_versions(*feeds):
+    """Версии нескольких лент одним чтением кеша."""
+    versions = {
+        feed_version_key(feed): feed for feed in feeds
+    }
+    found = cache.get_many(list(versions))
+    return {
+        feed: found[key] if key in found else feed_version(feed)
+        for key, feed in versions.items()
+    }
 
 
-def get_paginated_post(request, post_list):
-    pag = Paginator(post_list, COUNT_PAGE)
-    page_number = request.GET.get('page')
+def feed_modified_key(feed):
+    return f'feed_modified:{feed}'
+
+
+def feed_last_modified(feed):
+    """Время последнего изменения ленты для Last-Modified.
+
+    Запросов к базе нет: метка лежит рядом с версией и сдвигается
+    вместе с ней. Пропавшая из кеша метка считается текущим временем.
+    """
+    key = feed_modified_key(feed)
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = int(time.time())
+        if not cache.add(key, stamp, FEED_VERSION_TIMEOUT):
+            stamp = cache.get(key, stamp)
+    return datetime.fromtimestamp(stamp, timezone.utc)
+
+
+def bump_feed_versions(*feeds):
+    """Делает устаревшими все закешированные страницы лент feeds."""
+    for feed in feeds:
+        key = feed_version_key(feed)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), FEED_VERSION_TIMEOUT)
+    # Last-Modified считается в секундах: метка растет хотя бы на
+    # секунду, иначе правка в ту же секунду дала бы клиенту 304.
+    keys = [feed_modified_key(feed) for feed in feeds]
+    now = int(time.time())
+    stamps = cache.get_many(keys)
+    cache.set_many(
+        {key: max(now, stamps.get(key, 0) + 1) for key in keys},
+        FEED_VERSION_TIMEOUT,
+    )
+
+
+def post_refs_key(post_id):
+    return f'post_refs:{post_id}'
+
+
+def remember_post_refs(post):
+    """Кладет в кеш автора и группу поста для post_page_feeds."""
+    cache.set(
+        post_refs_key(post.pk), (post.author_id, post.group_id),
+        FEED_VERSION_TIMEOUT,
+    )
+
+
+def page_feeds(feed, depends, kwargs):
+    """Имя ленты из аргументов URL и лент, от которых зависит страница.
+
+    None, если depends еще не знает своих лент.
+    """
+    names = [feed.format(**kwargs)]
+    if depends is not None:
+        extra = depends(**kwargs)
+        if extra is None:
+            return None
+        names.extend(extra)
+    return names
+
+
+def page_version(names):
+    """Версия страницы из версий всех ее лент, одним чтением кеша."""
+    versions = feed_versions(*names)
+    return '.'.join(str(versions[name]) for name in names)
+
+
+def cache_feed(feed, timeout=FEED_CACHE_TIMEOUT, depends=None):
+    """Кеширует страницу ленты feed, пока не изменится ее версия.
+
+    feed - шаблон имени ленты, его поля берутся из аргументов URL.
+    depends(**kwargs) - имена других лент, данные которых тоже есть на
+    странице, их версии входят в ключ. Пока depends возвращает None,
+    страница целиком не кешируется. Гостям страница отдается из кеша
+    целиком. Пользователям шапка и формы рендерятся заново, а общая
+    часть берется из кеша фрагментов по ключу request.feed_cache_key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            names = page_feeds(feed, depends, kwargs)
+            known = names is not None
+            names = names or [feed.format(**kwargs)]
+            prefix = f'{names[0]}:{page_version(names)}'
+            request.feed_cache_timeout = timeout
+            request.feed_cache_key = f'{prefix}:{request.get_full_path()}'
+            if request.user.is_authenticated or not known:
+                return view(request, *args, **kwargs)
+            cached_view = cache_page(timeout, key_prefix=prefix)(view)
+            response = cached_view(request, *args, **kwargs)
+            # cache_page разрешает клиенту хранить страницу timeout
+            # секунд. Сервер держит ее в кеше, а клиент каждый раз
+            # переспрашивает по ETag.
+            del response['Expires']
+            patch_cache_control(response, no_cache=True, max_age=0)
+            return response
+        return wrapper
+    return decorator
+
+
+def feed_conditions(feed, etag_prefix='', depends=None):
+    """Функции ETag и Last-Modified для condition по ленте feed.
+
+    feed и depends - как в cache_feed. Обе функции читают только кеш,
+    поэтому 304 обходится без базы.
+    """
+    def etag(request, **kwargs):
+        names = page_feeds(feed, depends, kwargs)
+        if names is None:
+            return None
+        return f'{etag_prefix}{page_version(names)}'
+
+    def last_modified(request, **kwargs):
+        names = page_feeds(feed, depends, kwargs)
+        if names is None:
+            return None
+        return max(feed_last_modified(name) for name in names)
+
+    return {'etag_func': etag, 'last_modified_func': last_modified}
+
+
+def conditional_page(feed, depends=None):
+    """Отвечает 304, пока не изменилась версия страницы ленты feed.
+
+    К ETag добавляется id пользователя: шапка и формы у каждого свои.
+    Проверка идет до вызова view, шаблон не рендерится.
+    """
+    conditions = feed_conditions(feed, depends=depends)
+    feed_etag = conditions['etag_func']
+
+    def etag(request, **kwargs):
+        version = feed_etag(request, **kwargs)
+        if version is None:
+            return None
+        return f'{version}-{request.user.pk or 0}'
+
+    def decorator(view):
+        return condition(
+            etag, conditions['last_modified_func']
+        )(vary_on_cookie(view))
+    return decorator
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, который хранит число записей ленты в кеше."""
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, feed=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.feed = feed
+
+    @cached_property
+    def count(self):
+        if self.feed is None:
+            return super().count
+        key = feed_count_key(self.feed)
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def get_elided_page_range(self, number=1, on_each_side=PAGES_ON_EACH_SIDE,
+                              on_ends=PAGES_ON_ENDS):
+        """Первые, последние и соседние с текущей страницы, между ними …"""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (self.num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+
+def get_numbered_page(object_list, page_number, feed=None):
+    pag = CachedCountPaginator(object_list, COUNT_PAGE, feed=feed)
     page_object = pag.get_page(page_number)
+    page_object.elided_page_range = list(
+        pag.get_elided_page_range(page_object.number)
+    )
     return page_object
+
+
+def get_comments_page(request, comment_list):
+    """Комментарии от старых к новым, страница по курсору."""
+    return get_cursor_page(
+        comment_list, request.GET.get(CURSOR_PARAM), per_page=COMMENTS_PAGE,
+        field='created', descending=False,
+    )
+
+
+def get_paginated_post(request, post_list, feed=None):
+    if CURSOR_PARAM in request.GET:
+        return get_cursor_page(post_list, request.GET.get(CURSOR_PARAM))
+    return get_numbered_page(post_list, request.GET.get('page'), feed=feed)
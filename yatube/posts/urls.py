@@ -1,16 +1,38 @@
 from django.urls import path
 
-from . import views
+from . import api, views
+from .feeds import (
+    GroupPostsFeed, LatestPostsFeed, ProfilePostsFeed, conditional_feed
+)
 
 app_name = "posts"
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('rss/', conditional_feed(LatestPostsFeed), name='index_rss'),
+    path('atom/', conditional_feed(LatestPostsFeed, atom=True),
+         name='index_atom'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    path('group/<slug:slug>/rss/', conditional_feed(GroupPostsFeed),
+         name='group_rss'),
+    path('group/<slug:slug>/atom/',
+         conditional_feed(GroupPostsFeed, atom=True), name='group_atom'),
+    path('group/<slug:slug>/export/', views.group_export,
+         name='group_export'),
+    path('search/', views.search, name='search'),
+    path('autocomplete/', views.autocomplete_names, name='autocomplete'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('profile/<str:username>/rss/', conditional_feed(ProfilePostsFeed),
+         name='profile_rss'),
+    path('profile/<str:username>/atom/',
+         conditional_feed(ProfilePostsFeed, atom=True), name='profile_atom'),
+    path('profile/<str:username>/export/', views.profile_export,
+         name='profile_export'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='edit'),
+    path('posts/<int:post_id>/comments/', views.post_comments,
+         name='comments'),
     path('posts/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'
@@ -26,4 +48,16 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('api/posts/', api.index, name='api_index'),
+    path('api/posts/new/', api.index_new, name='api_index_new'),
+    path('api/posts/<int:post_id>/', api.post_detail, name='api_post'),
+    path('api/posts/<int:post_id>/comments/', api.post_comments,
+         name='api_comments'),
+    path('api/group/<slug:slug>/', api.group_posts, name='api_group'),
+    path('api/group/<slug:slug>/new/', api.group_new, name='api_group_new'),
+    path('api/profile/<str:username>/', api.profile, name='api_profile'),
+    path('api/profile/<str:username>/new/', api.profile_new,
+         name='api_profile_new'),
+    path('api/follow/', api.follow_index, name='api_follow'),
+    path('api/follow/new/', api.follow_new, name='api_follow_new'),
 ]
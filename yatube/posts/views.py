@@ -1,25 +1,39 @@
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from posts.forms import PostForm, CommentForm
 from .models import Group, Post, User, Follow
 from django.contrib.auth.decorators import login_required
-from .ulits import get_paginated_post
-from django.views.decorators.cache import cache_page
+from .ulits import (
+    cache_feed, conditional_page, get_comments_page, get_numbered_page,
+    get_paginated_post, post_refs_key, remember_post_refs,
+)
+from . import autocomplete, export
+from .images import enqueue_thumbnails, prefetch_thumbnails
+from .search import SearchResults, fts_supported
+from .timeline import get_timeline_posts
 
 
-@cache_page(20)
+@conditional_page('index')
+@cache_feed('index')
 def index(request):
-    post_list = Post.objects.all()
-    page_obj = get_paginated_post(request, post_list)
+    post_list = Post.objects.select_related('author', 'group')
+    page_obj = get_paginated_post(request, post_list, feed='index')
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page('group:{slug}')
+@cache_feed('group:{slug}')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = get_paginated_post(request, posts)
+    posts = group.posts.select_related('author', 'group')
+    page_obj = get_paginated_post(request, posts, feed=f'group:{slug}')
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -27,10 +41,79 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
-def profile(request, username):
+def search(request):
+    query = request.GET.get('q', '').strip()
+    if fts_supported():
+        results = SearchResults(query)
+    else:
+        results = Post.objects.select_related('author', 'group').filter(
+            text__icontains=query
+        ) if query else Post.objects.none()
+    page_obj = get_numbered_page(results, request.GET.get('page'))
+    prefetch_thumbnails(page_obj.object_list)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def autocomplete_names(request):
+    urls = {
+        autocomplete.USER: 'posts:profile',
+        autocomplete.GROUP: 'posts:group_list',
+    }
+    results = [
+        {'type': kind, 'label': label, 'url': reverse(urls[kind], args=[arg])}
+        for kind, label, arg in autocomplete.index.search(
+            request.GET.get('q', '')
+        )
+    ]
+    return JsonResponse({'results': results})
+
+
+def export_posts(posts, filename, data_format):
+    if data_format not in export.LINES:
+        raise Http404('Неизвестный формат выгрузки')
+    response = StreamingHttpResponse(
+        export.LINES[data_format](export.export_rows(posts)),
+        content_type=export.CONTENT_TYPES[data_format],
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{filename}.{data_format}"'
+    )
+    return response
+
+
+@login_required
+def profile_export(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    page_obj = get_paginated_post(request, posts)
+    return export_posts(
+        author.posts.all(), f'profile-{author.pk}',
+        request.GET.get('format', 'jsonl'),
+    )
+
+
+@login_required
+def group_export(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return export_posts(
+        group.posts.all(), f'group-{group.pk}',
+        request.GET.get('format', 'jsonl'),
+    )
+
+
+@conditional_page('profile:{username}')
+@cache_feed('profile:{username}')
+def profile(request, username):
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts = author.posts.select_related('author', 'group')
+    page_obj = get_paginated_post(
+        request, posts, feed=f'profile:{username}'
+    )
     following = (request.user.is_authenticated
                  and author.following.filter(user=request.user).exists())
     context = {
@@ -41,9 +124,32 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+def post_page_feeds(post_id):
+    """Ленты сайдбара поста: автор с числом постов и группа.
+
+    Автор и группа поста берутся только из кеша, чтобы 304 обходился
+    без базы. При промахе их запоминает сама post_detail.
+    """
+    refs = cache.get(post_refs_key(post_id))
+    if refs is None:
+        return None
+    author_id, group_id = refs
+    feeds = [f'author:{author_id}']
+    if group_id is not None:
+        feeds.append(f'card-group:{group_id}')
+    return feeds
+
+
+@conditional_page('post:{post_id}', depends=post_page_feeds)
+@cache_feed('post:{post_id}', depends=post_page_feeds)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id
+    )
+    remember_post_refs(post)
+    comments = get_comments_page(
+        request, post.comments.select_related('author')
+    )
     form = CommentForm()
     context = {
         'form': form,
@@ -53,6 +159,20 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@cache_feed('post:{post_id}')
+def post_comments(request, post_id):
+    """Следующая страница комментариев фрагментом для post_detail."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = get_comments_page(
+        request, post.comments.select_related('author')
+    )
+    context = {
+        'post_id': post.pk,
+        'comments': comments,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     title = 'Создать новый пост'
@@ -62,6 +182,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        enqueue_thumbnails(post)
         return redirect('posts:profile', username=user.username)
     context = {
         'title': title,
@@ -84,7 +205,8 @@ def post_edit(request, post_id):
     )
     if form.is_valid():
         post = form.save()
-        post.save()
+        if 'image' in form.changed_data:
+            enqueue_thumbnails(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'title': title,
@@ -110,8 +232,10 @@ def add_comment(request, post_id):
 def follow_index(request):
     follower_user = request.user
     fol_authors = Follow.objects.filter(user=follower_user).values('author')
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_paginated_post(request, posts)
+    posts = get_timeline_posts(follower_user)
+    page_obj = get_paginated_post(
+        request, posts, feed=f'follow:{follower_user.pk}'
+    )
     context = {
         'page_obj': page_obj,
         'fol_authors': fol_authors,
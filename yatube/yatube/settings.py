@@ -44,7 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'posts',
+    'posts.apps.PostsConfig',
     'users',
     'core',
     'about',
@@ -148,8 +148,24 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Версии лент, счетчики и изменения автодополнения должны видеть все
+# процессы, поэтому в бою нужен общий кеш: MEMCACHED_LOCATION, например
+# 127.0.0.1:11211, включает memcached.
+MEMCACHED_LOCATION = os.getenv('MEMCACHED_LOCATION')
+SHARED_CACHE = bool(MEMCACHED_LOCATION)
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION,
+        }
+    }
+else:
+    # Кеш своего процесса годится для runserver и тестов. Сроки
+    # хранения в posts.ulits тогда короткие: чужой процесс отдаст
+    # старую страницу не дольше LOCAL_CACHE_TIMEOUT.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}